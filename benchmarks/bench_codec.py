@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Compares the storage codecs on the kind of values Liara keeps in Redis.
+
+Run from the repository root with ``python benchmarks/bench_codec.py``.
+"""
+
+import os
+import sys
+import timeit
+
+import dill
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.utils import codec  # noqa: E402
+from cogs.utils.runtime import CoreMode  # noqa: E402
+
+
+def guild_settings(ignores):
+    return {
+        'roles': {'admin': 'administrators', 'mod': 'moderators'},
+        'ignores': [248000000000000000 + x for x in range(ignores)]
+    }
+
+
+SAMPLES = {
+    'small guild': guild_settings(3),
+    'large guild': guild_settings(500),
+    'instance': {'mode': CoreMode.up},
+    'prefixes': ['!', 'liara '],
+}
+
+CODECS = {
+    # name: (dumps, loads, compression)
+    'dill (legacy)': (dill.dumps, dill.loads, None),
+    'pickle': (lambda x: codec.encode(x, codec.default), codec.decode, None),
+    'dill (tagged)': (lambda x: codec.encode(x, codec.fallback), codec.decode, None),
+    'pickle+zlib': (lambda x: codec.encode(x, codec.default), codec.decode, 'zlib'),
+    'pickle+lzma': (lambda x: codec.encode(x, codec.default), codec.decode, 'lzma'),
+}
+
+
+def main(number=2000):
+    print('{:<14} {:<14} {:>10} {:>12} {:>12}'.format('sample', 'codec', 'bytes', 'encode µs', 'decode µs'))
+    for sample, value in SAMPLES.items():
+        for name, (dumps, loads, compression) in CODECS.items():
+            codec.compression = compression or codec.compression
+            codec.compression_threshold = 1024 if compression else None
+            data = dumps(value)
+            assert loads(data) == value
+            encode_time = timeit.timeit(lambda: dumps(value), number=number) / number * 1e6
+            decode_time = timeit.timeit(lambda: loads(data), number=number) / number * 1e6
+            print('{:<14} {:<14} {:>10} {:>12.2f} {:>12.2f}'.format(sample, name, len(data), encode_time,
+                                                                    decode_time))
+    print('\ncompression: {}'.format(codec.compression_stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Measures shard-to-shard request round trips, as IPC works now and as it used to, on a thread with dill.
+
+Both shards share an in-process MemoryBackend, so this measures Liara's own overhead and none of the network's. Run
+from the repository root with ``python benchmarks/bench_ipc.py``.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dill
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.utils.backend import MemoryBackend  # noqa: E402
+from cogs.utils.ipc import IPC  # noqa: E402
+from cogs.utils.metrics import Histogram  # noqa: E402
+
+
+class Shard:
+    """Just enough of a bot for IPC."""
+    def __init__(self, redis, loop, shard_id, shard_count, engine):
+        self.redis = redis
+        self.loop = loop
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.ipc = engine(self, 'liara.0.pubsub.code')
+
+
+class ThreadPoolIPC(IPC):
+    """IPC as it used to be, every message dill-pickled and handled on a single worker thread.
+
+    Unlike the original, replies and futures are handed back to the loop thread-safely, or it would hang.
+    """
+    def __init__(self, liara, channel):
+        super().__init__(liara, channel)
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    def _encode(self, message, pickled=False):
+        return dill.dumps(message)
+
+    async def _receive(self, data):
+        self.pool.submit(self._receive_in_thread, data)
+
+    def _receive_in_thread(self, data):
+        message = dill.loads(data)
+        if message['type'] == 'response':
+            self.liara.loop.call_soon_threadsafe(self._resolve, message)
+        elif message['type'] == 'ping' and message['target'] == self.liara.shard_id:
+            asyncio.run_coroutine_threadsafe(self._respond(message, 'Pong.'), self.liara.loop)
+
+
+async def measure(engine, number, padding):
+    loop = asyncio.get_event_loop()
+    redis = MemoryBackend()
+    shards = [Shard(redis, loop, x, 2, engine) for x in range(2)]
+    tasks = [loop.create_task(x.ipc.listen()) for x in shards]
+    await asyncio.sleep(0.05)  # let them subscribe
+    latency = Histogram()
+    extra = {'padding': 'x' * padding} if padding else {}
+    for _ in range(number):
+        started = time.perf_counter()
+        await asyncio.wait_for(shards[0].ipc.request(1, type='ping', **extra), 5)
+        latency.record(time.perf_counter() - started)
+    for task in tasks:
+        task.cancel()
+    return latency
+
+
+def sizes():
+    shard = Shard(MemoryBackend(), None, 0, 2, IPC)
+    request = {'v': 1, 'id': '6fa459ea-ee8a-3ca4-894e-db77e160355e', 'target': 1, 'type': 'call',
+               'method': 'sharding.info', 'args': [], 'kwargs': {}}
+    legacy = {'id': request['id'], 'target': 1, 'type': 'coderequest', 'function': sizes, 'args': (), 'kwargs': {}}
+    print('\nrequest size: {} B as a named call, {} B with a pickled function'.format(
+        len(shard.ipc._encode(request)), len(dill.dumps(legacy))))
+
+
+def main(number=2000):
+    print('{:<14} {:<10} {:>9} {:>9} {:>9}'.format('ipc', 'payload', 'p50 µs', 'p95 µs', 'p99 µs'))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for padding in (0, 256 * 1024):
+        for name, engine in (('dill, thread', ThreadPoolIPC), ('json, loop', IPC)):
+            latency = loop.run_until_complete(measure(engine, number if not padding else number // 10, padding))
+            print('{:<14} {:<10} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                name, '{} B'.format(padding) if padding else 'ping', latency.percentile(50) * 1e6,
+                latency.percentile(95) * 1e6, latency.percentile(99) * 1e6))
+    sizes()
+
+
+if __name__ == '__main__':
+    main()
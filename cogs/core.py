@@ -1,5 +1,6 @@
 import asyncio
 import datetime
+import functools
 import inspect
 import json
 import random
@@ -12,8 +13,12 @@ import discord
 from discord.ext import commands
 
 from cogs.utils import checks
+from cogs.utils.prefix import PrefixMatcher
+from cogs.utils.ratelimit import RateLimiter
+from cogs.utils.scheduler import CommandScheduler, Overloaded
+from cogs.utils.tracing import Trace, TracedContext, tracer
 from cogs.utils.runtime import CoreMode
-from cogs.utils.storage import RedisCollection
+from cogs.utils.storage import migrate_all_keys
 
 
 def reload_core(liara):
@@ -21,6 +26,11 @@ def reload_core(liara):
 
 
 class Core:
+    # scope -> (commands, per seconds), see RateLimiter. Nothing is limited until an owner sets a limit.
+    default_ratelimits = {}
+    # bump this along with a new step in _migrate, stored settings older than this get migrated at boot
+    schema_version = 1
+
     def __init__(self, liara):
         self.liara = liara
 
@@ -28,12 +38,34 @@ class Core:
         self.verbose_errors = False  # tracebacks?
         self.informative_errors = True  # info messages based on error
 
-        self.settings = RedisCollection(self.liara.redis, 'settings')
+        self.settings = self.liara.settings  # one cache per process for the global settings
+        self.settings.watch(self.liara.instance_id, self._load_mode)  # another shard might set our mode
+        # and the global settings, which we'd otherwise have to poll for
+        self.settings.watch('cogs', self._load_cogs)
+        self.settings.watch('prefixes', self._load_prefixes)
+        self.settings.watch('owners', self._load_owners)
+        self.settings.watch('ratelimits', self._load_ratelimits)
+        self.sync_interval = getattr(self.liara.args, 'sync_interval', 300)  # seconds between full reloads
+        self._app_owner_id = None  # always an owner, filled in once we can ask Discord
+        self.ratelimiter = RateLimiter(self.liara.redis, self.default_ratelimits)
+        self._slowed_down = {}  # user ID -> time.monotonic() until which they've been told to slow down
+        self.scheduler = CommandScheduler(getattr(self.liara.args, 'max_concurrent', 32),
+                                          getattr(self.liara.args, 'max_queued', 5),
+                                          getattr(self.liara.args, 'max_per_guild', 8))
+        self.lazy_cogs = getattr(self.liara.args, 'lazy_cogs', False)  # stand in for cogs until they're used
+        self._stubs = {}  # cog name -> names of the stub commands standing in for it
+        self.boot_phases = {}  # boot phase -> seconds it took, filled in by _post
+        self.liara.ipc.register('core.reload', reload_core)
+        self.liara.before_invoke(self._before_invoke)  # marks the end of checks and argument conversion
         self.logger = self.liara.logger
         self.liara.loop.create_task(self._post())
         self.global_preconditions = [self._ignore_preconditions]  # preconditions to message processing
         self.global_preconditions_overrides = [self._ignore_overrides]  # overrides to the preconditions
         self._eval = {}
+        self._ignores = {}  # guild ID -> frozenset of ignored user, channel and guild IDs, loaded on first use
+        self._role_ids = {}  # guild ID -> {'admin'/'mod': frozenset of IDs of roles with the configured name}
+        self._guild_watchers = {}  # (guild ID, attribute) -> callback run when another shard edits that setting
+        self._prefix_matcher = None  # recompiled whenever the prefixes or our user change
         self.loop = None  # make pycharm stop complaining
 
         for obj in dir(self):  # docstring formatting
@@ -48,16 +80,36 @@ class Core:
 
     def __unload(self):
         self.loop.cancel()
-
-    async def _cog_loop(self):
-        cogs: list = await self.settings.get('cogs', [])
+        self.liara.ipc.unregister('core.reload')
+        self.liara._before_invoke = None
+        self.settings.unwatch(self.liara.instance_id, self._load_mode)
+        self.settings.unwatch('cogs', self._load_cogs)
+        self.settings.unwatch('prefixes', self._load_prefixes)
+        self.settings.unwatch('owners', self._load_owners)
+        self.settings.unwatch('ratelimits', self._load_ratelimits)
+        for (guild_id, attribute), callback in self._guild_watchers.items():
+            self.liara.guild_settings.collection(guild_id).unwatch(attribute, callback)
+        for cog in list(self._stubs):
+            self._remove_stubs(cog)
+
+    async def _cog_loop(self, cogs: list=None):
+        if cogs is None:
+            cogs = await self.settings.get('cogs', [])
+        manifest = await self.settings.get('cog_manifest', {}) if self.lazy_cogs else {}
         edited = False
         for cog in cogs:
-            if cog not in list(self.liara.extensions):
+            if cog not in list(self.liara.extensions) and cog not in self._stubs:
+                entry = manifest.get(cog)
+                if entry is not None and entry.get('lazy'):
+                    self._add_stubs(cog, entry)
+                    continue
                 # noinspection PyBroadException
                 try:
                     await self.load_cog(cog)
                 except Exception:
+                    if self.lazy_cogs:  # it might need something a lazy cog would have set up, don't forget it
+                        self.logger.exception('{!r} could not be loaded.'.format(cog))
+                        continue
                     cogs.remove(cog)
                     edited = True
                     self.logger.warning('{!r} could not be loaded. This message will not be shown again.'.format(cog))
@@ -69,100 +121,273 @@ class Core:
                 continue
             if cog not in cogs:
                 self.liara.unload_extension(cog)
+        for cog in list(self._stubs):
+            if cog not in cogs:
+                self._remove_stubs(cog)
+
+    def _loaded(self) -> tuple:
+        """Takes stock of what's loaded, so the difference made by loading an extension can be found."""
+        return (set(self.liara.all_commands.values()), set(self.liara.cogs),
+                {x for listeners in self.liara.extra_events.values() for x in listeners})
+
+    def _manifest_entry(self, name, before) -> dict:
+        """Describes what loading a cog added, and whether it can wait until one of its commands is used.
+
+        Only extensions which opt in with a module-level ``lazy = True`` are ever loaded lazily, since there's no
+        telling what else they do when loaded.
+        """
+        new_commands, new_cogs, new_listeners = (now - then for now, then in zip(self._loaded(), before))
+        entry = {'lazy': getattr(self.liara.extensions.get(name), 'lazy', False) is True, 'commands': {}}
+        for command in new_commands:
+            entry['commands'][command.name] = {'aliases': list(command.aliases), 'help': command.help,
+                                               'hidden': command.hidden, 'owner': checks.owner_check in command.checks}
+        # listeners and cog-wide checks would never run if we waited for a command
+        for cog in (self.liara.cogs[x] for x in new_cogs):
+            if any(x.startswith('on_') or x.endswith(('__global_check', '__global_check_once', '__local_check'))
+                   for x in dir(cog)):
+                entry['lazy'] = False
+        if new_listeners or not entry['commands']:
+            entry['lazy'] = False
+        return entry
+
+    async def _update_manifest(self, name, before):
+        manifest = await self.settings.get('cog_manifest', {})
+        entry = self._manifest_entry(name, before)
+        if manifest.get(name) != entry:
+            manifest[name] = entry
+            await self.settings.set('cog_manifest', manifest)
+
+    def _add_stubs(self, cog, entry):
+        names = []
+        for name, info in entry['commands'].items():
+            if any(self.liara.get_command(x) is not None for x in [name] + info['aliases']):
+                continue  # something else took the name since, the real command can fight over it when it loads
+            callback = self._stub_callback(cog)
+            if info.get('owner'):  # nobody else gets to make us import it
+                callback = checks.is_owner()(callback)
+            stub = commands.command(name=name, aliases=info['aliases'], help=info['help'],
+                                    hidden=info['hidden'])(callback)
+            self.liara.add_command(stub)
+            names.append(name)
+        self._stubs[cog] = names
+        self.logger.debug('Standing in for cog {} with {} commands until it is used.'.format(cog, len(names)))
+
+    def _remove_stubs(self, cog):
+        for name in self._stubs.pop(cog, ()):
+            self.liara.remove_command(name)
+
+    def _stub_callback(self, cog):
+        async def stub(ctx, *, _: str=None):
+            await self.load_cog(cog)
+            real = await self.liara.get_context(ctx.message, cls=TracedContext)
+            real.trace = getattr(ctx, 'trace', None)
+            await self.liara.invoke(real)
+        return stub
 
     async def _get_guild_setting(self, guild_id, attribute, default=None):
-        guild = await self.settings.get('guilds:{}'.format(guild_id), {})
-        return guild.get(attribute, default)
+        return await self.liara.guild_settings.get(guild_id, attribute, default)
 
     async def _set_guild_setting(self, guild_id, attribute, value):
-        guild = await self.settings.get('guilds:{}'.format(guild_id), {})
-        guild[attribute] = value
-        await self.settings.set('guilds:{}'.format(guild_id), guild)
+        await self.liara.guild_settings.set(guild_id, attribute, value)
 
     async def _post(self):
         """Power-on self test. Beep boop."""
         self.liara.owners = []
+        self.boot_phases.clear()
+        started = time.perf_counter()
+
+        # fetch everything we need to boot in one go
+        prefixes, cogs, instance, ratelimits, schema_version, roles, ignores = await self._phase(
+            'fetch', self.settings.get_many(['prefixes', 'cogs', self.liara.instance_id, 'ratelimits',
+                                             'schema_version', 'roles', 'ignores']))
+        if ratelimits is not None:
+            self.ratelimiter.configure(ratelimits)
+
+        # none of these depend on each other
+        await asyncio.gather(self._phase('prefixes', self._boot_prefixes(prefixes)),
+                             self._phase('cogs', self._cog_loop(cogs or [])),
+                             self._phase('mode', self._boot_mode(instance)),
+                             self._phase('migrations', self._migrate(schema_version or 0, roles, ignores)))
+
+        await self._phase('gateway', self.liara.wait_until_ready())
+        self.liara.ready = True
+        if self.liara.mode == CoreMode.boot:
+            await self.set_mode(CoreMode.up)
+        self.boot_phases['total'] = time.perf_counter() - started
+        self.logger.info('Booted in {:.2f}s ({}).'.format(self.boot_phases['total'], ', '.join(
+            '{} {:.2f}s'.format(k, v) for k, v in self.boot_phases.items() if k != 'total')))
 
-        # set prefixes
+        # start the loop
+        self.loop = self.liara.loop.create_task(self._maintenance_loop())
+
+    async def _phase(self, name, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.boot_phases[name] = time.perf_counter() - started
+
+    async def _boot_prefixes(self, prefixes):
         prefix = str(random.randint(1, 2**8))
-        prefixes = await self.settings.get('prefixes')
         if prefixes is None:
             prefixes = [prefix]
             await self.settings.set('prefixes', prefixes)
         self.liara.command_prefix = prefixes
         self.logger.info('{}\'s prefixes are: {}'.format(self.liara.name, ', '.join(map(repr, prefixes))))
 
-        # Load cogs
-        await self._cog_loop()
-
-        # Mess with the instance's mode
-        instance = await self.settings.get(self.liara.instance_id, {'mode': CoreMode.boot})
+    async def _boot_mode(self, instance):
+        if instance is None:
+            instance = {'mode': CoreMode.boot}
+        self.liara.mode = instance['mode']
         if not self.liara.ready:
-            if instance['mode'] == CoreMode.up:
-                instance['mode'] = CoreMode.boot
-                await self.settings.set(self.liara.instance_id, instance)
+            if self.liara.mode == CoreMode.up:
+                await self.set_mode(CoreMode.boot)
 
-        await self.liara.wait_until_ready()
-        self.liara.ready = True
-        if instance['mode'] == CoreMode.boot:
-            instance['mode'] = CoreMode.up
-            await self.settings.set(self.liara.instance_id, instance)
-
-        # migration
-        keys = await self.settings.keys()
-        if 'roles' in keys:
-            roles = await self.settings.get('roles')
-            for guild in roles:
-                await self._set_guild_setting(
-                    int(guild), 'roles', {k.rstrip('_role'): v for k, v in roles[guild].items()}
-                )
-            await self.settings.delete('roles')
-        if 'ignores' in keys:
-            ignores = await self.settings.get('ignores')
-            for guild in ignores:
+    async def _migrate(self, schema_version, roles, ignores):
+        """Brings stored settings up to date, if the schema version marker says they aren't."""
+        if schema_version >= self.schema_version:
+            return
+        if roles is not None or ignores is not None:
+            migrated = {}
+            for guild in roles or {}:
+                migrated.setdefault(int(guild), {})['roles'] = {k.rstrip('_role'): v for k, v in roles[guild].items()}
+            for guild in ignores or {}:
                 entry = []
                 [entry.append(int(x)) for x in ignores[guild]['ignored_channels']]
                 if ignores[guild]['server_ignore']:
                     entry.append(int(guild))
-                await self._set_guild_setting(int(guild), 'ignores', entry)
-            await self.settings.delete('ignores')
-
-        # start the loop
-        self.loop = self.liara.loop.create_task(self._maintenance_loop())
+                migrated.setdefault(int(guild), {})['ignores'] = entry
+            for guild, attributes in migrated.items():
+                await self.liara.guild_settings.set_many(guild, attributes)
+            await self.settings.delete_many(['roles', 'ignores'])
+        migrated = await self.liara.guild_settings.migrate(self.settings)  # scans every key
+        if migrated:
+            self.logger.info('Moved {} guilds to field-level settings storage.'.format(migrated))
+        await self.settings.set('schema_version', self.schema_version)
 
     async def _maintenance_loop(self):
+        """Reloads the global settings every so often.
+
+        Changes made through Liara reach every shard as they happen, this catches the ones that didn't, like writes
+        made by third-party applications or missed while the connection was down.
+        """
         app_info = await self.liara.application_info()
+        self._app_owner_id = app_info.owner.id
         while True:
+            cogs, prefixes, owners, ratelimits = await self.settings.get_many(['cogs', 'prefixes', 'owners',
+                                                                              'ratelimits'])
+            self.ratelimiter.configure(self.default_ratelimits if ratelimits is None else ratelimits)
             if not self.ignore_db:
-                # Loading cogs / Unloading cogs
-                await self._cog_loop()
-                # Prefix changing
-                self.liara.command_prefix = await self.settings.get('prefixes')
-                # Owner checks
-                owners = await self.settings.get('owners', [])
-                owners = list(map(int, owners))
-                if app_info.owner.id not in owners:
-                    owners.append(app_info.owner.id)
-                    await self.settings.set('owners', owners)
-                self.liara.owners = owners
-            await asyncio.sleep(1)
+                await self._cog_loop(cogs or [])
+                self._apply_prefixes(prefixes)
+                await self._apply_owners(owners)
+            await asyncio.sleep(self.sync_interval)
+
+    async def _load_cogs(self):
+        if not self.ignore_db:
+            await self._cog_loop()
+
+    async def _load_prefixes(self):
+        if not self.ignore_db:
+            self._apply_prefixes(await self.settings.get('prefixes'))
+
+    async def _load_owners(self):
+        if not self.ignore_db:
+            await self._apply_owners(await self.settings.get('owners'))
+
+    async def _load_ratelimits(self):
+        self.ratelimiter.configure(await self.settings.get('ratelimits', self.default_ratelimits))
+
+    def _apply_prefixes(self, prefixes):
+        if prefixes:
+            self.liara.command_prefix = prefixes
+
+    async def _apply_owners(self, owners, save=False):
+        owners = list(map(int, owners or []))
+        if self._app_owner_id is not None and self._app_owner_id not in owners:
+            owners.append(self._app_owner_id)
+            save = True
+        if save:
+            await self.settings.set('owners', owners)
+        self.liara.owners = owners
+
+    async def _load_mode(self):
+        instance = await self.settings.get(self.liara.instance_id, {})
+        self.liara.mode = instance.get('mode', CoreMode.down)
+
+    async def set_mode(self, mode: CoreMode):
+        """Sets this instance's mode, both in memory and in Redis."""
+        self.liara.mode = mode
+        instance = await self.settings.get(self.liara.instance_id, {})
+        instance['mode'] = mode
+        await self.settings.set(self.liara.instance_id, instance)
 
     async def _ignore_overrides(self, message):
         if isinstance(message.author, discord.Member):
             if message.guild.owner == message.author:
                 return True
-            try:
-                roles = {x.name.lower() for x in message.author.roles}
-                settings = await self._get_guild_setting(message.guild.id, 'roles', {})
-                admin = settings.get('admin')
-                if admin in roles:
-                    return True
-            except KeyError or AttributeError:
-                pass
+            admin = await self.resolve_role(message.guild, 'admin')
+            if not admin.isdisjoint(x.id for x in message.author.roles):
+                return True
+
+    async def _get_ignores(self, guild_id) -> frozenset:
+        ignores = self._ignores.get(guild_id)
+        if ignores is not None:
+            return ignores
+        self._watch_guild_setting(guild_id, 'ignores', functools.partial(self._ignores.pop, guild_id, None))
+        ignores = frozenset(await self._get_guild_setting(guild_id, 'ignores', []))
+        return self._ignores.setdefault(guild_id, ignores)  # don't clobber an edit made while we were loading
+
+    async def _set_ignores(self, guild_id, ignores):
+        await self._set_guild_setting(guild_id, 'ignores', ignores)
+        self._ignores[guild_id] = frozenset(ignores)
+
+    def _watch_guild_setting(self, guild_id, attribute, callback):
+        if (guild_id, attribute) in self._guild_watchers:
+            return
+        self._guild_watchers[guild_id, attribute] = callback
+        self.liara.guild_settings.collection(guild_id).watch(attribute, callback)
+
+    async def resolve_role(self, guild, role) -> frozenset:
+        """Gets the IDs of the roles in a guild named like its configured admin or moderator role.
+
+        - role: 'admin' or 'mod'
+        """
+        resolved = self._role_ids.get(guild.id)
+        if resolved is not None and role in resolved:
+            return resolved[role]
+        self._watch_guild_setting(guild.id, 'roles', functools.partial(self._role_ids.pop, guild.id, None))
+        name = (await self._get_guild_setting(guild.id, 'roles', {})).get(role)
+        if name is None:
+            ids = frozenset()
+        else:
+            ids = frozenset(x.id for x in guild.roles if x.name.lower() == name.lower())
+        self._role_ids.setdefault(guild.id, {})[role] = ids
+        return ids
+
+    async def on_guild_role_create(self, role):
+        self._role_ids.pop(role.guild.id, None)
+
+    async def on_guild_role_delete(self, role):
+        self._role_ids.pop(role.guild.id, None)
+
+    async def on_guild_role_update(self, before, after):
+        if before.name != after.name:
+            self._role_ids.pop(after.guild.id, None)
+
+    async def on_guild_remove(self, guild):
+        self._ignores.pop(guild.id, None)
+        self._role_ids.pop(guild.id, None)
+        for attribute in ('ignores', 'roles'):
+            callback = self._guild_watchers.pop((guild.id, attribute), None)
+            if callback is not None:
+                self.liara.guild_settings.collection(guild.id).unwatch(attribute, callback)
 
     async def _ignore_preconditions(self, message):
         if isinstance(message.author, discord.Member):
-            ignores = await self._get_guild_setting(message.guild.id, 'ignores', [])
+            ignores = self._ignores.get(message.guild.id)
+            if ignores is None:
+                ignores = await self._get_ignores(message.guild.id)
 
             if message.author.id in ignores:
                 return False
@@ -195,7 +420,10 @@ class Core:
         if name in self.liara.extensions:
             return
 
+        self._remove_stubs(name)
+        before = self._loaded()
         self.liara.load_extension(name)
+        await self._update_manifest(name, before)
 
         cogs = await self.settings.get('cogs', [])
         if name not in cogs:
@@ -204,13 +432,24 @@ class Core:
 
         self.logger.debug('Cog {} loaded successfully'.format(name))
 
+    def _could_be_command(self, message) -> bool:
+        prefixes = self.liara.command_prefix
+        user_id = self.liara.user and self.liara.user.id
+        matcher = self._prefix_matcher
+        if matcher is None or matcher.source is not prefixes or matcher.user_id != user_id:
+            matcher = self._prefix_matcher = PrefixMatcher(prefixes, user_id)
+        return matcher(message.content)
+
     async def on_message(self, message):
-        instance = await self.settings.get(self.liara.instance_id, {})
-        mode = instance.get('mode', CoreMode.down)
+        if not self._could_be_command(message):  # most messages, no need to look any further
+            return
+        trace = Trace()
+        mode = self.liara.mode
+        trace.mark('mode')
         if mode in (CoreMode.down, CoreMode.boot):
             return
         if message.author.id in self.liara.owners:  # *always* process owner commands
-            await self.liara.process_commands(message)
+            await self._process_commands(message, trace, owner=True)
             return
         if mode == CoreMode.maintenance:
             return
@@ -222,12 +461,14 @@ class Core:
                 if inspect.isawaitable(out):
                     out = await out
                 if out is True:
-                    await self.liara.process_commands(message)
+                    trace.mark('overrides')
+                    await self._process_commands(message, trace)
                     return
             except Exception:
                 self.logger.exception('Removed precondition override "{}", it was malfunctioning.'
                                       .format(override.__name__))
                 self.global_preconditions_overrides.remove(override)
+        trace.mark('overrides')
         # Preconditions
         for precondition in self.global_preconditions:
             # noinspection PyBroadException
@@ -241,8 +482,59 @@ class Core:
                 self.logger.exception('Removed precondition "{}", it was malfunctioning.'
                                       .format(precondition.__name__))
                 self.global_preconditions.remove(precondition)
+        trace.mark('preconditions')
+
+        await self._process_commands(message, trace)
+
+    async def _process_commands(self, message, trace, owner=False):
+        ctx = await self.liara.get_context(message, cls=TracedContext)
+        ctx.trace = trace
+        trace.mark('resolve')
+        if ctx.command is None:
+            await self.liara.invoke(ctx)
+            return
+        if owner:  # owners skip the line, they might be trying to fix whatever is holding it up
+            await self._invoke(ctx)
+            return
+        wait = await self.ratelimiter.hit(ctx)
+        if wait:
+            self.logger.debug('Rate limited {} ({}) for {:.2f}s.'.format(message.author, message.author.id, wait))
+            await self._slow_down(ctx, wait)
+            return
+        trace.mark('ratelimit')
+        queue = ctx.guild.id if ctx.guild else ctx.channel.id
+        try:
+            await self.scheduler.run(queue, functools.partial(self._invoke, ctx))
+        except Overloaded:
+            self.logger.debug('Shed command {} in {}, its queue is full.'.format(ctx.command.qualified_name,
+                                                                                 ctx.guild or ctx.channel))
+            try:
+                await ctx.send('I\'m a little busy here right now, please try that again in a moment.')
+            except discord.HTTPException:
+                pass
+
+    async def _slow_down(self, ctx, wait):
+        # tell them once per time they're limited, so spamming doesn't turn into the bot spamming back
+        now = time.monotonic()
+        if self._slowed_down.get(ctx.author.id, 0) > now:
+            return
+        self._slowed_down[ctx.author.id] = now + wait
+        if len(self._slowed_down) > 4096:
+            self._slowed_down = {k: v for k, v in self._slowed_down.items() if v > now}
+        try:
+            await ctx.send('Slow down a little, you can use commands again in {:.1f}s.'.format(wait))
+        except discord.HTTPException:
+            pass
+
+    async def _invoke(self, ctx):
+        ctx.trace.mark('queue')
+        await self.liara.invoke(ctx)
+        ctx.trace.mark('command' if 'checks' in ctx.trace.stages else 'checks')  # no command stage if a check failed
+        tracer.record(ctx)
 
-        await self.liara.process_commands(message)
+    async def _before_invoke(self, ctx):
+        if isinstance(ctx, TracedContext) and ctx.trace is not None:
+            ctx.trace.mark('checks')
 
     async def on_command_error(self, context, exception):
         try:
@@ -329,6 +621,30 @@ class Core:
         await self.settings.set('prefixes', prefixes)
         await ctx.send('Prefix(es) set.')
 
+    @set_cmd.command()
+    @checks.is_owner()
+    async def ratelimit(self, ctx, scope: str, rate: int, per: float=None):
+        """Sets how many commands can be used every so often.
+
+        - scope: user, channel or guild, or command:<name> for a single command (per user)
+        - rate: The amount of commands allowed, 0 to remove the limit
+        - per: The amount of seconds they are allowed in
+        """
+        if scope not in ('user', 'channel', 'guild') and not scope.startswith('command:'):
+            await self.liara.send_command_help(ctx)
+            return
+        ratelimits = dict(await self.settings.get('ratelimits', self.default_ratelimits))
+        if rate > 0:
+            if per is None or per <= 0:
+                await self.liara.send_command_help(ctx)
+                return
+            ratelimits[scope] = (rate, per)
+        else:
+            ratelimits.pop(scope, None)
+        await self.settings.set('ratelimits', ratelimits)
+        self.ratelimiter.configure(ratelimits)
+        await ctx.send('Rate limit set.')
+
     @set_cmd.command()
     @checks.is_owner()
     async def name(self, ctx, username: str):
@@ -366,7 +682,7 @@ class Core:
 
         - owners: A list of owners to use
         """
-        await self.settings.set('owners', [x.id for x in list(owners)])
+        await self._apply_owners([x.id for x in list(owners)], save=True)
         if len(list(owners)) == 1:
             await ctx.send('Owner set.')
         else:
@@ -393,6 +709,7 @@ class Core:
                            'If you didn\'t intend to do this, use `{}help set admin` for help.'
                            .format(ctx.prefix))
         await self._set_guild_setting(ctx.guild.id, 'roles', roles)
+        self._role_ids.pop(ctx.guild.id, None)
 
     @set_cmd.command()
     @commands.guild_only()
@@ -415,6 +732,7 @@ class Core:
                            'If you didn\'t intend to do this, use `{}help set moderator` for help.'
                            .format(ctx.prefix))
         await self._set_guild_setting(ctx.guild.id, 'roles', roles)
+        self._role_ids.pop(ctx.guild.id, None)
 
     @set_cmd.group(name='ignore', invoke_without_command=True)
     @checks.admin_or_permissions()
@@ -444,7 +762,7 @@ class Core:
             if channel in ignores:
                 ignores.remove(channel)
             await ctx.send('Channel unignored.')
-        await self._set_guild_setting(ctx.guild.id, 'ignores', ignores)
+        await self._set_ignores(ctx.guild.id, ignores)
 
     @ignore_cmd.command()
     @checks.admin_or_permissions()
@@ -466,10 +784,11 @@ class Core:
             if guild in ignores:
                 ignores.remove(guild)
             await ctx.send('Server unignored.')
-        await self._set_guild_setting(ctx.guild.id, 'ignores', ignores)
+        await self._set_ignores(ctx.guild.id, ignores)
 
     async def halt_(self):
         self.ignore_db = True
+        self.liara.mode = CoreMode.down
         for cog in list(self.liara.extensions):
             self.liara.unload_extension(cog)
         await asyncio.sleep(2)  # to let some functions clean up their mess
@@ -525,8 +844,11 @@ class Core:
             await ctx.send('Sorry, I can\'t let you do that. '
                            'If you want to install a custom loader, look into the documentation.')
             return
-        if name in list(self.liara.extensions):
-            self.liara.unload_extension(name)
+        if name in list(self.liara.extensions) or name in self._stubs:
+            if name in self._stubs:
+                self._remove_stubs(name)
+            else:
+                self.liara.unload_extension(name)
             cogs = await self.settings.get('cogs')
             cogs.remove(name)
             await self.settings.set('cogs', cogs)
@@ -539,12 +861,13 @@ class Core:
     async def reload(self, ctx, name: str):
         """Reloads a cog."""
         if name == 'core':
-            await self.liara.run_on_shard(None if self.liara.shard_id is None else 'all', reload_core)
+            await self.liara.call_shard(None if self.liara.shard_id is None else 'all', 'core.reload')
             await ctx.send('Command dispatched, reloading core on all shards now.')
             return
-        if name in list(self.liara.extensions):
+        if name in list(self.liara.extensions) or name in self._stubs:
             msg = await ctx.send('`{}` reloading...'.format(name))
-            self.liara.unload_extension(name)
+            if name in list(self.liara.extensions):
+                self.liara.unload_extension(name)
             await self.load_cog(name)
             if name in list(self.liara.extensions):
                 await msg.edit(content='`{}` reloaded successfully.'.format(name))
@@ -554,6 +877,29 @@ class Core:
         else:
             await ctx.send('Unable to reload, that cog isn\'t loaded.')
 
+    @commands.command(hidden=True)
+    @checks.is_owner()
+    async def boottime(self, ctx):
+        """Shows how long each part of {}'s last boot took."""
+        if 'total' not in self.boot_phases:
+            return await ctx.send('Still booting.')
+        lines = ['{:<12} {:>8.2f}s'.format(k, v) for k, v in self.boot_phases.items()]
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)))
+
+    @commands.command(hidden=True)
+    @checks.is_owner()
+    async def migrate_keys(self, ctx):
+        """Rewrites stored settings to the compact key format.
+
+        Safe to run while other shards are up, and more than once. Shards stop looking up the old format once they
+        restart.
+        """
+        async with ctx.typing():
+            migrated = await migrate_all_keys(self.liara.redis)
+        if not migrated:
+            return await ctx.send('Everything is already using the compact key format.')
+        await ctx.send('Rewrote {} keys in {} hashes.'.format(sum(migrated.values()), len(migrated)))
+
     @commands.command(hidden=True, aliases=['debug'])
     @checks.is_owner()
     async def eval(self, ctx, *, code: str):
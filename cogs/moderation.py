@@ -5,6 +5,8 @@ from discord.ext import commands
 
 from cogs.utils import checks
 
+lazy = True  # nothing to set up and no listeners, so --lazy_cogs can wait for a command before loading this
+
 
 class MemberIDConverter(commands.MemberConverter):
     async def convert(self, ctx, argument):
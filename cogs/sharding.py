@@ -1,4 +1,5 @@
 import platform
+import time
 
 import datetime
 from discord.ext import commands
@@ -17,16 +18,15 @@ tabulate.MIN_PADDING = 0  # makes for a neater table
 
 
 def gather_info(liara):
-    return {'status': liara.settings[liara.instance_id]['mode'].value, 'guilds': len(liara.guilds),
+    return {'status': liara.mode.value, 'guilds': len(liara.guilds),
             'members': len(set(liara.get_all_members())), 'up_since': liara.boot_time,
             'messages_seen': liara.get_cog('Sharding').messages, 'host': platform.node().lower(),
             'memory': psutil.Process().memory_full_info().uss / 1024**2,
-            'host_uptime': psutil.boot_time()}
+            'host_uptime': psutil.boot_time(), 'boot_phases': dict(liara.get_cog('Core').boot_phases)}
 
 
 def set_mode(liara, mode):
-    liara.settings[liara.instance_id]['mode'] = mode
-    liara.settings.commit(liara.instance_id)
+    return liara.get_cog('Core').set_mode(CoreMode(mode))
 
 
 def _halt(liara, ignore=None):
@@ -40,6 +40,13 @@ class Sharding:
         self.liara = liara
         self.lines = []
         self.messages = 0
+        self.liara.ipc.register('sharding.info', gather_info)
+        self.liara.ipc.register('sharding.set_mode', set_mode)
+        self.liara.ipc.register('sharding.halt', _halt)
+
+    def __unload(self):
+        for name in ('sharding.info', 'sharding.set_mode', 'sharding.halt'):
+            self.liara.ipc.unregister(name)
 
     async def on_message(self, _):
         self.messages += 1
@@ -53,20 +60,28 @@ class Sharding:
     async def list(self, ctx, mode='generic'):
         """Lists all shards.
 
-        * mode: "generic" or "host"
+        * mode: "generic", "host" or "boot"
 
         Arguments marked with * are optional.
         """
-        if mode.lower() not in ('generic', 'host'):
+        if mode.lower() not in ('generic', 'host', 'boot'):
             await ctx.send('Invalid mode.')
             return await self.liara.send_command_help(ctx)
         msg = await ctx.send('Fetching statistics, please wait...')
-        shards = await self.liara.run_on_shard('all', gather_info)
-        for shard, resp in dict(shards).items():
-            print(shard, resp)
-            if repr(resp) == '<NoResponse>':
+        shards = {x: {'status': 'waiting'} for x in range(self.liara.shard_count)}
+        last_edit = time.monotonic()
+        async for shard, resp in self.liara.stream_shards('sharding.info'):
+            if isinstance(resp, dict):  # an error means the shard is running something older
+                shards[shard] = resp
+            if time.monotonic() - last_edit > 1:  # show what we have so far, without hitting rate limits
+                await msg.edit(content=self._render(shards, mode))
+                last_edit = time.monotonic()
+        for shard, state in shards.items():
+            if state['status'] == 'waiting':  # didn't answer in time
                 shards[shard] = {'status': CoreMode.down.value}
+        await msg.edit(content=self._render(shards, mode))
 
+    def _render(self, shards, mode):
         table = []
         if mode == 'generic':
             table = [['Active', 'Shard', 'Status', 'Guilds', 'Members', 'Messages', ]]
@@ -86,9 +101,18 @@ class Sharding:
                         datetime.datetime.utcfromtimestamp(state.get('host_uptime', 0)) if state.get('host_uptime')
                         else '']
                 table.append(line)
-        table = '```prolog\n{}\n```'.format(
+        if mode == 'boot':
+            table = [['Active', 'Shard', 'Status', 'Boot', 'Slowest Phase']]
+            for shard, state in shards.items():
+                phases = dict(state.get('boot_phases', {}))
+                total = phases.pop('total', None)
+                slowest = max(phases.items(), key=lambda x: x[1]) if phases else None
+                line = ['*' if shard == self.liara.shard_id else '', shard+1, state['status'],
+                        '{:.2f}s'.format(total) if total is not None else '',
+                        '{} ({:.2f}s)'.format(*slowest) if slowest else '']
+                table.append(line)
+        return '```prolog\n{}\n```'.format(
             tabulate.tabulate(table, tablefmt='psql', headers='firstrow'))
-        await msg.edit(content=table)
 
     @shards.command()
     async def get(self, ctx):
@@ -109,7 +133,7 @@ class Sharding:
         if self.liara.shard_id == shard-1 and mode in (CoreMode.down, CoreMode.boot):
             return await ctx.send('This action would be too dangerous to perform on the current shard. Try running '
                                   'this command from a different shard targeting this one.')
-        await self.liara.run_on_shard(shard-1, set_mode, mode)
+        await self.liara.call_shard(shard-1, 'sharding.set_mode', mode.value)
         await ctx.send('Mode set.')
 
     @shards.command(aliases=['shutdown'])
@@ -122,7 +146,7 @@ class Sharding:
         active = await self.liara.ping_shard(shard-1)
         if not active:
             return await ctx.send('Shard not online.')
-        await self.liara.run_on_shard(shard-1, _halt)
+        await self.liara.call_shard(shard-1, 'sharding.halt')
         await ctx.send('Halt command sent.')
 
     @shards.command()
@@ -130,7 +154,7 @@ class Sharding:
     async def halt_all(self, ctx):
         """Halts all shards."""
         msg = await ctx.send('Sending command...')
-        await self.liara.run_on_shard('all', _halt, self.liara.shard_id)
+        await self.liara.call_shard('all', 'sharding.halt', self.liara.shard_id)
         await msg.edit(content='Thank you for using Liara.')
         await self.liara.get_cog('Core').halt_()
 
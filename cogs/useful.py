@@ -5,7 +5,7 @@ from datetime import datetime
 
 from discord.ext import commands
 
-from cogs.utils import checks
+from cogs.utils import checks, codec, storage, tracing
 
 
 class Useful:
@@ -125,6 +125,77 @@ class Useful:
             table += '\n`{}`: {}'.format(k, v)
         await ctx.send('{} socket events seen since {}.{}'.format(sum(self.event_counter.values()), boot_time, table))
 
+    @commands.command(hidden=True)
+    @checks.is_owner()
+    async def storagestats(self, ctx, amount: int=15):
+        """Shows which collections {} spends the most time in storage on.
+
+        - amount (optional): The amount of collection/operation pairs to show
+        """
+        snapshot = storage.stats.snapshot()
+        if not snapshot:
+            return await ctx.send('No storage operations recorded yet.')
+
+        def ms(value):
+            return '{:.2f}'.format((value or 0) * 1000)
+
+        top = sorted(snapshot.items(), key=lambda x: x[1]['calls'] * (x[1]['latency']['mean'] or 0), reverse=True)
+        lines = ['{:<20} {:<11} {:>7} {:>7} {:>7} {:>9} {:>9} {:>7} {:>7} {:>7}'.format(
+            'Collection', 'Operation', 'Calls', 'Trips', 'Hits', 'Read', 'Written', 'p50ms', 'p99ms', 'Codec')]
+        for (collection, operation), op in top[:amount]:
+            lines.append('{:<20} {:<11} {:>7} {:>7} {:>7} {:>9} {:>9} {:>7} {:>7} {:>7}'.format(
+                collection[:20], operation, op['calls'], op['round_trips'], op['cache_hits'], op['bytes_read'],
+                op['bytes_written'], ms(op['latency']['p50']), ms(op['latency']['p99']), ms(op['codec']['mean'])))
+        compression = codec.compression_stats
+        lines.append('\nCompressed {} values to {:.0%} of their size, {} didn\'t shrink.'.format(
+            compression.compressed, compression.ratio, compression.skipped))
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)))
+
+    @commands.command(hidden=True)
+    @checks.is_owner()
+    async def latency(self, ctx, amount: int=15):
+        """Shows where {} spends its time processing commands.
+
+        - amount (optional): The amount of commands to show, slowest first
+        """
+        snapshot = tracing.tracer.snapshot()
+        if not snapshot['commands']:
+            return await ctx.send('No commands recorded yet.')
+
+        def ms(value):
+            return '{:.1f}'.format((value or 0) * 1000)
+
+        lines = ['{:<24} {:>7} {:>8} {:>8} {:>8}'.format('Stage', 'Count', 'p50ms', 'p95ms', 'p99ms')]
+        for stage in tracing.STAGES:
+            summary = snapshot['stages'].get(stage)
+            if summary is not None:
+                lines.append('{:<24} {:>7} {:>8} {:>8} {:>8}'.format(stage, summary['count'], ms(summary['p50']),
+                                                                     ms(summary['p95']), ms(summary['p99'])))
+        lines.append('\n{:<24} {:>7} {:>8} {:>8} {:>8}'.format('Command', 'Count', 'p50ms', 'p95ms', 'p99ms'))
+        top = sorted(snapshot['commands'].items(), key=lambda x: x[1]['p99'], reverse=True)
+        for name, summary in top[:amount]:
+            lines.append('{:<24} {:>7} {:>8} {:>8} {:>8}'.format(name[:24], summary['count'], ms(summary['p50']),
+                                                                 ms(summary['p95']), ms(summary['p99'])))
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)))
+
+    @commands.command(hidden=True)
+    @checks.is_owner()
+    async def slowcommands(self, ctx, amount: int=5):
+        """Shows the latest commands which took {} too long.
+
+        - amount (optional): The amount of commands to show
+        """
+        slow = list(tracing.tracer.slow)[-amount:]
+        if not slow:
+            return await ctx.send('No commands took longer than {}s.'.format(tracing.tracer.slow_threshold))
+        lines = []
+        for entry in reversed(slow):
+            lines.append('{} ({:.2f}s) {} {}\n    {}'.format(
+                entry['command'], entry['elapsed'], ' '.join(entry['args']),
+                ' '.join('{}={}'.format(k, v) for k, v in entry['kwargs'].items()),
+                ', '.join('{} {:.0f}ms'.format(k, v * 1000) for k, v in entry['stages'].items())))
+        await ctx.send('```\n{}\n```'.format('\n'.join(lines)[:1990]))
+
 
 def setup(liara):
     liara.add_cog(Useful(liara))
@@ -0,0 +1,401 @@
+import asyncio
+import fnmatch
+import itertools
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+
+def database_id(redis) -> int:
+    """Gets the database number of a storage backend, used to namespace pub/sub channels."""
+    db = getattr(redis, 'db', None)
+    if db is None:
+        db = redis.connection_pool.connection_kwargs.get('db', 0)
+    return db
+
+
+def _b(value) -> bytes:
+    """Converts a key or value to bytes the way aredis does before sending it."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, (int, float)):
+        return repr(value).encode()
+    raise TypeError('invalid input of type {}'.format(type(value).__name__))
+
+
+class MemoryBackend:
+    """An in-process stand-in for :class:`aredis.StrictRedis`, for single-host deployments.
+
+    It implements the part of aredis Liara uses: plain string keys, hashes, pipelines and pub/sub. Every write is
+    appended to ``path`` (if given) and replayed on startup, and the file is compacted into a snapshot of the current
+    data whenever it grows to ``compact_ratio`` times the size of that snapshot.
+
+    All methods are safe to call from any thread, but pub/sub messages are only delivered to subscribers within this
+    process. For the same reason, only one process can use ``path`` at a time, others fail with :class:`RuntimeError`.
+    """
+    _scan_limit = 1024  # unfinished HSCANs we keep around before dropping the oldest
+
+    def __init__(self, path=None, db=0, compact_ratio=4):
+        self.path = path
+        self.db = db
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._data = {}
+        self._subscribers = {}  # channel -> set of MemoryPubSub
+        self._scans = OrderedDict()  # cursor -> (hash name, fields left to return)
+        self._cursors = itertools.count(1)
+        self._log = None
+        self._lock_file = None
+        self._snapshot_size = 0
+        if path is not None:
+            self._acquire()
+            self._replay()
+
+    # persistence
+
+    def _acquire(self):
+        # a separate file, since compaction replaces the data file and any lock held on it
+        self._lock_file = open(self.path + '.lock', 'a')
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError('{} is already in use by another process'.format(self.path))
+
+    def _replay(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                while True:
+                    try:
+                        command, args = pickle.load(f)
+                    except EOFError:
+                        break
+                    except (pickle.UnpicklingError, ValueError):  # torn write from a crash, everything before is good
+                        break
+                    getattr(self, '_' + command)(*args)
+        self._compact()
+
+    def _compact(self):
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            pickle.dump(('restore', (self._data,)), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.path, 'ab')
+        self._snapshot_size = self._log.tell()
+
+    def _write(self, command, *args):
+        out = getattr(self, '_' + command)(*args)
+        if self._log is not None:
+            pickle.dump((command, args), self._log, protocol=pickle.HIGHEST_PROTOCOL)
+            self._log.flush()
+            if self._log.tell() > max(self._snapshot_size, 65536) * self.compact_ratio:
+                self._compact()
+        return out
+
+    def close(self):
+        """Closes the append-only file, letting other processes use it."""
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if self._lock_file is not None:
+                self._lock_file.close()  # releases the lock
+                self._lock_file = None
+
+    # raw operations, only ever called with the lock held
+
+    def _restore(self, data):
+        self._data = data
+
+    def _set(self, name, value):
+        self._data[name] = value
+        return True
+
+    def _delete(self, *names):
+        return sum(self._data.pop(x, None) is not None for x in names)
+
+    def _hash(self, name, create=False) -> dict:
+        value = self._data.get(name)
+        if value is None:
+            value = {}
+            if create:
+                self._data[name] = value
+        elif not isinstance(value, dict):
+            raise TypeError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _hset(self, name, key, value):
+        h = self._hash(name, create=True)
+        new = key not in h
+        h[key] = value
+        return int(new)
+
+    def _hmset(self, name, mapping):
+        self._hash(name, create=True).update(mapping)
+        return True
+
+    def _hdel(self, name, *keys):
+        h = self._hash(name)
+        deleted = sum(h.pop(x, None) is not None for x in keys)
+        if not h:
+            self._data.pop(name, None)
+        return deleted
+
+    # the aredis interface
+
+    async def ping(self):
+        return True
+
+    async def get(self, name):
+        with self._lock:
+            value = self._data.get(_b(name))
+            if isinstance(value, dict):
+                raise TypeError('WRONGTYPE Operation against a key holding the wrong kind of value')
+            return value
+
+    async def set(self, name, value):
+        with self._lock:
+            return self._write('set', _b(name), _b(value))
+
+    async def delete(self, *names):
+        with self._lock:
+            return self._write('delete', *map(_b, names))
+
+    async def exists(self, name):
+        with self._lock:
+            return _b(name) in self._data
+
+    async def hget(self, name, key):
+        with self._lock:
+            return self._hash(_b(name)).get(_b(key))
+
+    async def hset(self, name, key, value):
+        with self._lock:
+            return self._write('hset', _b(name), _b(key), _b(value))
+
+    async def hmset(self, name, mapping):
+        if not mapping:
+            raise ValueError("'hmset' with 'mapping' of length 0")
+        with self._lock:
+            return self._write('hmset', _b(name), {_b(k): _b(v) for k, v in mapping.items()})
+
+    async def hmget(self, name, keys, *args):
+        with self._lock:
+            h = self._hash(_b(name))
+            return [h.get(_b(x)) for x in itertools.chain(keys, args)]
+
+    async def hdel(self, name, *keys):
+        with self._lock:
+            return self._write('hdel', _b(name), *map(_b, keys))
+
+    async def hexists(self, name, key):
+        with self._lock:
+            return _b(key) in self._hash(_b(name))
+
+    async def hlen(self, name):
+        with self._lock:
+            return len(self._hash(_b(name)))
+
+    async def hkeys(self, name):
+        with self._lock:
+            return list(self._hash(_b(name)))
+
+    async def hvals(self, name):
+        with self._lock:
+            return list(self._hash(_b(name)).values())
+
+    async def hgetall(self, name):
+        with self._lock:
+            return dict(self._hash(_b(name)))
+
+    def _page(self, scope, cursor, items, count):
+        """Pages through a snapshot of ``items()`` taken when the scan started, like SCAN's cursors."""
+        if cursor:
+            scan = self._scans.pop(cursor, None)
+            if scan is None or scan[0] != scope:
+                return 0, []
+            left = scan[1]
+        else:
+            left = list(items())
+        batch, left = left[:count or 10], left[count or 10:]
+        if not left:
+            return 0, batch
+        cursor = next(self._cursors)
+        self._scans[cursor] = (scope, left)
+        while len(self._scans) > self._scan_limit:
+            self._scans.popitem(last=False)
+        return cursor, batch
+
+    async def hscan(self, name, cursor=0, match=None, count=None):
+        name = _b(name)
+        with self._lock:
+            h = self._hash(name)
+            cursor, batch = self._page(name, cursor, h.keys, count)
+            batch = [x for x in batch if x in h]
+            if match is not None:
+                batch = [x for x in batch if fnmatch.fnmatchcase(x.decode(errors='replace'), match)]
+            return cursor, {x: h[x] for x in batch}
+
+    async def scan(self, cursor=0, match=None, count=None):
+        with self._lock:
+            cursor, batch = self._page(None, cursor, self._data.keys, count)
+            batch = [x for x in batch if x in self._data]
+            if match is not None:
+                batch = [x for x in batch if fnmatch.fnmatchcase(x.decode(errors='replace'), match)]
+            return cursor, batch
+
+    async def type(self, name):
+        with self._lock:
+            value = self._data.get(_b(name))
+        if value is None:
+            return b'none'
+        return b'hash' if isinstance(value, dict) else b'string'
+
+    async def publish(self, channel, message):
+        channel = _b(channel)
+        message = {'type': 'message', 'pattern': None, 'channel': channel, 'data': _b(message)}
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber._deliver(message)
+        return len(subscribers)
+
+    def pubsub(self, **kwargs):
+        return MemoryPubSub(self, **kwargs)
+
+    async def pipeline(self, transaction=True, shard_hint=None):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """Buffers commands and runs them back to back on :meth:`execute`, like an aredis pipeline."""
+    def __init__(self, backend: MemoryBackend):
+        self.backend = backend
+        self.command_stack = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.reset()
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def __getattr__(self, item):
+        command = getattr(self.backend, item)
+
+        async def queue(*args, **kwargs):
+            self.command_stack.append((command, args, kwargs))
+            return self
+        return queue
+
+    async def reset(self):
+        self.command_stack = []
+
+    async def execute(self, raise_on_error=True):
+        stack, self.command_stack = self.command_stack, []
+        out = []
+        with self.backend._lock:  # nobody else gets to run in between, like MULTI/EXEC
+            for command, args, kwargs in stack:
+                try:
+                    out.append(await command(*args, **kwargs))
+                except Exception as e:
+                    if raise_on_error:
+                        raise
+                    out.append(e)
+        return out
+
+
+class MemoryPubSub:
+    """A subscription to :class:`MemoryBackend` channels, with the aredis PubSub interface."""
+    def __init__(self, backend: MemoryBackend, ignore_subscribe_messages=False):
+        self.backend = backend
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels = set()
+        self._loop = None
+        self._queue = None
+
+    @property
+    def subscribed(self):
+        return bool(self.channels)
+
+    def _deliver(self, message):
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, message)
+        except RuntimeError:  # the subscriber's loop is closed
+            pass
+
+    async def subscribe(self, *channels):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+            self._queue = asyncio.Queue()
+        with self.backend._lock:
+            for channel in map(_b, channels):
+                self.channels.add(channel)
+                self.backend._subscribers.setdefault(channel, set()).add(self)
+                self._queue.put_nowait({'type': 'subscribe', 'pattern': None, 'channel': channel,
+                                        'data': len(self.channels)})
+
+    async def unsubscribe(self, *channels):
+        with self.backend._lock:
+            for channel in list(map(_b, channels)) or list(self.channels):
+                self.channels.discard(channel)
+                subscribers = self.backend._subscribers.get(channel, set())
+                subscribers.discard(self)
+                if not subscribers:
+                    self.backend._subscribers.pop(channel, None)
+                if self._queue is not None:
+                    self._queue.put_nowait({'type': 'unsubscribe', 'pattern': None, 'channel': channel,
+                                            'data': len(self.channels)})
+
+    async def listen(self):
+        if self.subscribed:
+            return self._filter(await self._queue.get())
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0):
+        if self._queue is None:
+            return None
+        try:
+            if timeout:
+                message = await asyncio.wait_for(self._queue.get(), timeout)
+            else:
+                message = self._queue.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return None
+        return self._filter(message, ignore_subscribe_messages)
+
+    def _filter(self, message, ignore_subscribe_messages=False):
+        if message['type'] != 'message' and (ignore_subscribe_messages or self.ignore_subscribe_messages):
+            return None
+        return message
+
+    def reset(self):
+        with self.backend._lock:
+            for channel in self.channels:
+                subscribers = self.backend._subscribers.get(channel, set())
+                subscribers.discard(self)
+                if not subscribers:
+                    self.backend._subscribers.pop(channel, None)
+        self.channels = set()
+        self._queue = None
+        self._loop = None
+
+    close = reset
@@ -7,9 +7,12 @@ def owner_check(ctx):
 
 
 async def role_check(ctx, _role):
+    core = ctx.bot.get_cog('Core')
+    if hasattr(core, 'resolve_role'):  # cached by role ID, third-party core cogs might not have it
+        role_ids = await core.resolve_role(ctx.guild, _role)
+        return not role_ids.isdisjoint(x.id for x in ctx.author.roles)
     roles = {x.name.lower() for x in ctx.author.roles}
-    settings = await ctx.bot.settings.get('guilds:{}'.format(ctx.guild.id), {})
-    role_settings = settings.get('roles', {})
+    role_settings = await ctx.bot.guild_settings.get(ctx.guild.id, 'roles', {})
     role = role_settings.get(_role)
     return role in roles
 
@@ -0,0 +1,145 @@
+import lzma
+import pickle
+import typing
+import zlib
+
+import dill
+
+
+class Codec:
+    """Turns stored values into bytes and back.
+
+    Every encoded value is prefixed with its codec's one-byte ``tag``, so readers can always tell which codec to
+    decode it with, no matter which one the writer was configured to use.
+    """
+    tag: bytes = None
+
+    def dumps(self, value) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data) -> typing.Any:
+        raise NotImplementedError
+
+
+class PickleCodec(Codec):
+    """The standard library's pickle. Fast and compact for plain data, but can't serialize lambdas or closures."""
+    tag = b'\x01'
+
+    def __init__(self, protocol=5):
+        self.protocol = protocol
+
+    def dumps(self, value):
+        return pickle.dumps(value, protocol=self.protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class DillCodec(Codec):
+    """dill, which serializes almost anything at the cost of speed and size."""
+    tag = b'\x02'
+
+    def dumps(self, value):
+        return dill.dumps(value)
+
+    def loads(self, data):
+        return dill.loads(data)
+
+
+class CompressionStats:
+    """Keeps track of how well compression is doing."""
+    __slots__ = ('compressed', 'skipped', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.compressed = 0  # values stored compressed
+        self.skipped = 0  # values over the threshold that didn't get any smaller
+        self.bytes_in = 0  # size of compressed values before compression
+        self.bytes_out = 0  # and after
+
+    def __repr__(self):
+        return '<CompressionStats compressed={0.compressed} skipped={0.skipped} ratio={0.ratio:.2f}>'.format(self)
+
+    @property
+    def ratio(self) -> float:
+        """Compressed size over original size, across every value compressed so far."""
+        if not self.bytes_in:
+            return 1.0
+        return self.bytes_out / self.bytes_in
+
+    def reset(self):
+        self.__init__()
+
+
+default = PickleCodec()
+fallback = DillCodec()
+_codecs = {}
+
+# values written before codecs existed are untagged dill, which always starts with the pickle PROTO opcode
+_LEGACY_TAG = b'\x80'
+
+# compressed values wrap a complete encoded value
+_compressors = {
+    'zlib': (b'\x03', zlib.compress, zlib.decompress),
+    'lzma': (b'\x04', lzma.compress, lzma.decompress),
+}
+_decompressors = {tag: decompress for tag, _, decompress in _compressors.values()}
+
+# values whose encoded size is above this many bytes get compressed, None disables compression
+compression_threshold = 1024
+compression = 'zlib'  # or 'lzma', which is smaller but a lot slower
+compression_stats = CompressionStats()
+
+
+def register(codec: Codec):
+    """Makes values written with ``codec`` readable."""
+    if codec.tag is None or len(codec.tag) != 1 or codec.tag == _LEGACY_TAG or codec.tag in _decompressors:
+        raise ValueError('codecs need a one-byte tag that is not reserved')
+    _codecs[codec.tag] = codec
+
+
+register(default)
+register(fallback)
+
+
+def encode(value, codec: Codec=None, record=True) -> bytes:
+    """Encodes a value with ``codec``, falling back to dill for values it can't handle.
+
+    Values larger than :data:`compression_threshold` are compressed if that makes them smaller. Unless ``record`` is
+    false, which is for values that are only encoded to be compared and won't be written, that goes into
+    :data:`compression_stats`.
+    """
+    if codec is None:
+        codec = default
+    try:
+        data = codec.tag + codec.dumps(value)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        if codec is fallback:
+            raise
+        data = fallback.tag + fallback.dumps(value)
+    if compression_threshold is None or len(data) <= compression_threshold:
+        return data
+    tag, compress, _ = _compressors[compression]
+    compressed = tag + compress(data)
+    if not record:
+        return data if len(compressed) >= len(data) else compressed
+    if len(compressed) >= len(data):
+        compression_stats.skipped += 1
+        return data
+    compression_stats.compressed += 1
+    compression_stats.bytes_in += len(data)
+    compression_stats.bytes_out += len(compressed)
+    return compressed
+
+
+def decode(data: bytes) -> typing.Any:
+    """Decodes a value written by :func:`encode`, or by dill directly."""
+    tag = data[:1]
+    if tag == _LEGACY_TAG:
+        return dill.loads(data)
+    if tag in _decompressors:
+        return decode(_decompressors[tag](memoryview(data)[1:]))
+    try:
+        codec = _codecs[tag]
+    except KeyError:
+        raise ValueError('unknown codec tag {!r}'.format(tag)) from None
+    return codec.loads(memoryview(data)[1:])
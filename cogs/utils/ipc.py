@@ -0,0 +1,309 @@
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import typing
+import uuid
+
+import aredis
+import dill
+
+
+log = logging.getLogger('liara.ipc')
+
+VERSION = 1  # of the envelope, messages with any other version are dropped
+_SCALARS = (str, int, type(None))  # what the id, method and from fields may hold, anything else can't be looked up
+_CODE_TAG = b'\x80'  # code requests are dill pickles, which start with the PROTO opcode, and JSON never does
+
+
+class NoResponse:
+    def __repr__(self):
+        return '<NoResponse>'
+
+    def __eq__(self, other):
+        if isinstance(other, NoResponse):
+            return True
+        else:
+            return False
+
+
+class RemoteError(Exception):
+    """Raised when a remote procedure failed on the shard that ran it, or couldn't be run at all."""
+    pass
+
+
+class IPC:
+    """Requests between shards over Redis pub/sub, handled on the bot's event loop.
+
+    Each shard listens on three channels under ``prefix``: its own for requests addressed to it, a broadcast channel
+    for requests to ``'all'`` shards, and a reply channel unique to this process, which requests name in their
+    ``reply_to``. No shard has to look at traffic meant for another.
+
+    Shards expose remote procedures by name with :meth:`register`, and call them with :meth:`call` or :meth:`stream`.
+    Those take ``broadcast_timeout`` and ``quorum`` as options of their own, so remote procedures can't have keyword
+    arguments by those names. Requests and responses are small JSON envelopes::
+
+        {"v": 1, "id": "...", "type": "call", "target": 0, "reply_to": "...", "method": "sharding.info",
+         "args": [], "kwargs": {}}
+        {"v": 1, "id": "...", "type": "response", "from": 0, "response": ...}  # or "error": "..." instead
+
+    so arguments and return values have to be JSON-serializable. Shipping arbitrary functions to other shards, with
+    :meth:`request` and ``type='code'``, is only possible if ``allow_code`` is set on both ends. Those requests and
+    their responses are dill pickles instead, so they can return anything dill can serialize.
+    """
+    large_payload = 65536  # bytes, anything bigger is decoded in an executor so the loop keeps going
+
+    def __init__(self, liara, prefix, allow_code=False):
+        self.liara = liara
+        self.prefix = prefix
+        self.broadcast_channel = prefix + '.all'
+        self.reply_channel = '{}.reply.{}'.format(prefix, uuid.uuid4().hex)
+        self.allow_code = allow_code
+        self.procedures = {}  # name -> callable taking the bot and the call's arguments
+        self.futures = {}  # request ID -> future resolved with the response
+        self.broadcasts = {}  # request ID -> ({shard ID: response}, responses needed), for requests to every shard
+        self.streams = {}  # request ID -> asyncio.Queue of (shard ID, response), for streamed broadcasts
+
+    def register(self, name, func):
+        """Exposes ``func`` to other shards as ``name``.
+
+        ``func`` is called with the bot and the call's arguments, and may return an awaitable.
+        """
+        if name in self.procedures:
+            raise ValueError('a remote procedure called {!r} is already registered'.format(name))
+        self.procedures[name] = func
+
+    def unregister(self, name):
+        self.procedures.pop(name, None)
+
+    def shard_channel(self, shard) -> str:
+        """Gets the channel requests for ``shard`` are sent on."""
+        return '{}.shard.{}'.format(self.prefix, 'main' if shard is None else shard)
+
+    async def listen(self):
+        """Receives requests and responses for as long as the bot runs."""
+        while True:
+            pubsub = self.liara.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.shard_channel(self.liara.shard_id), self.broadcast_channel,
+                                       self.reply_channel)
+                while True:
+                    message = await pubsub.listen()
+                    if message is None or message['type'] != 'message':
+                        continue
+                    # noinspection PyBroadException
+                    try:
+                        await self._receive(message['data'])
+                    except Exception:  # one bad message mustn't cut this shard off from the others
+                        log.exception('Failed to handle an IPC message.')
+            except aredis.ConnectionError:
+                log.warning('Lost the IPC channel, retrying in a second.')
+                await asyncio.sleep(1)
+            finally:
+                pubsub.reset()
+
+    def _encode(self, message, pickled=False) -> bytes:
+        if pickled or message.get('type') == 'code':
+            return dill.dumps(message)
+        return json.dumps(message, separators=(',', ':')).encode()
+
+    def _decode_now(self, data):
+        if data[:1] == _CODE_TAG:
+            if not self.allow_code:
+                return None
+            return dill.loads(data)
+        return json.loads(data.decode())
+
+    async def _decode(self, data):
+        if len(data) > self.large_payload:
+            return await self.liara.loop.run_in_executor(None, self._decode_now, data)
+        return self._decode_now(data)
+
+    async def _receive(self, data):
+        try:
+            message = await self._decode(data)
+        except Exception:  # anyone can publish anything, and decoding can fail in every way imaginable
+            log.debug('Dropped an undecodable IPC message.', exc_info=True)
+            return
+        if not isinstance(message, dict) or message.get('v') != VERSION or message.get('type') is None:
+            return
+        if not all(isinstance(message.get(x), _SCALARS) for x in ('id', 'method', 'from')):
+            return
+        if message['type'] == 'response':
+            self._resolve(message)
+            return
+        target = message.get('target')
+        if target == self.liara.shard_id or target == 'all':
+            if message['type'] == 'ping':
+                await self._respond(message, 'Pong.')
+            elif message['type'] == 'call':
+                self._call(message)
+            elif message['type'] == 'code':
+                self._run(message)
+
+    def _call(self, message):
+        func = self.procedures.get(message.get('method'))
+        if func is None:
+            self._reply(message, error='no remote procedure called {!r}'.format(message.get('method')))
+            return
+        self._invoke(message, func)
+
+    def _run(self, message):
+        func = message.get('function')  # get the function, discard if None
+        if func is None:
+            return
+        self._invoke(message, func)
+
+    def _invoke(self, message, func):
+        try:
+            # noinspection PyCallingNonCallable
+            response = func(self.liara, *message.get('args', ()), **message.get('kwargs', {}))
+        except Exception as e:
+            self._reply(message, error=e)
+            return
+        if inspect.isawaitable(response):
+            self.liara.loop.create_task(self._respond_later(message, response))
+        else:
+            self._reply(message, response)
+
+    async def _respond_later(self, message, awaitable):
+        try:
+            response = await awaitable
+        except Exception as e:
+            await self._respond(message, error=e)
+            return
+        await self._respond(message, response)
+
+    def _reply(self, message, response=None, error=None):
+        self.liara.loop.create_task(self._respond(message, response, error))
+
+    async def _respond(self, message, response=None, error=None):
+        out = {'v': VERSION, 'type': 'response', 'id': message.get('id')}
+        if message.get('target') == 'all':
+            out['from'] = self.liara.shard_id
+        if error is not None:
+            out['error'] = error if isinstance(error, str) else '{}: {}'.format(type(error).__name__, error)
+        else:
+            out['response'] = response
+        pickled = message.get('type') == 'code' and self.allow_code  # whoever sent code can decode pickles too
+        try:
+            data = self._encode(out, pickled)
+        except (TypeError, ValueError, dill.PicklingError):
+            out.pop('response', None)
+            out['error'] = 'the response could not be serialized'
+            data = self._encode(out, pickled)
+        reply_to = message.get('reply_to')
+        if not isinstance(reply_to, str) or not reply_to.startswith(self.prefix + '.reply.'):
+            return  # don't let requests make us publish anywhere else
+        await self.liara.redis.publish(reply_to, data)
+
+    def _resolve(self, message):
+        _id = message.get('id')
+        if 'error' in message:
+            response = RemoteError(message['error'])
+        else:
+            response = message.get('response')
+        _from = message.get('from')
+        stream = self.streams.get(_id)
+        if stream is not None:
+            stream.put_nowait((_from, response))
+            return
+        future = self.futures.get(_id)
+        if future is None:
+            return
+        if _from is None:
+            self.futures.pop(_id)
+            if future.done():  # the requester might have given up already
+                return
+            if isinstance(response, RemoteError):
+                future.set_exception(response)
+            else:
+                future.set_result(response)
+        elif _id in self.broadcasts:
+            responses, needed = self.broadcasts[_id]
+            responses[_from] = response
+            if sum(x != NoResponse() for x in responses.values()) >= needed:  # that was the last one we wait for
+                self._finish_broadcast(_id)
+
+    def _request(self, target, **kwargs) -> typing.Tuple[str, bytes]:
+        request = {'v': VERSION, 'id': str(uuid.uuid4()), 'target': target, 'reply_to': self.reply_channel}
+        request.update(kwargs)
+        if request.get('type') == 'code' and not self.allow_code:
+            raise RuntimeError('sending code to other shards is disabled')
+        return request['id'], self._encode(request)
+
+    def _publish(self, target, data) -> asyncio.Task:
+        channel = self.broadcast_channel if target == 'all' else self.shard_channel(target)
+        return self.liara.loop.create_task(self.liara.redis.publish(channel, data))
+
+    def request(self, target, broadcast_timeout=1, quorum=None, **kwargs) -> asyncio.Future:
+        """Sends a request to a shard, or to every shard if ``target`` is ``'all'``.
+
+        The future resolves with the response, or for broadcasts with a dict of shard IDs to their responses (or
+        :class:`NoResponse`, if they didn't answer within ``broadcast_timeout`` seconds). Broadcasts with a
+        ``quorum`` resolve as soon as that many shards answered.
+        """
+        _id, data = self._request(target, **kwargs)
+        self.futures[_id] = future = self.liara.loop.create_future()
+        future.add_done_callback(functools.partial(self._forget, _id))  # don't keep abandoned requests around
+        if target == 'all':
+            responses = {k: NoResponse() for k in range(0, self.liara.shard_count)}
+            self.broadcasts[_id] = (responses, len(responses) if quorum is None else quorum)
+            # whoever hasn't answered by then is reported as NoResponse
+            timer = self.liara.loop.call_later(broadcast_timeout, self._finish_broadcast, _id)
+            future.add_done_callback(lambda _: timer.cancel())
+        self._publish(target, data).add_done_callback(functools.partial(self._published, future))
+        return future
+
+    async def call(self, target, method, *args, broadcast_timeout=1, quorum=None, **kwargs):
+        """Calls the remote procedure registered as ``method`` on ``target``, see :meth:`request`.
+
+        Any other arguments are passed on to the procedure. Raises :class:`RemoteError` if it fails, except for
+        broadcasts, where the error is returned in its place.
+        """
+        return await self.request(target, broadcast_timeout, quorum, type='call', method=method, args=args,
+                                  kwargs=kwargs)
+
+    async def stream(self, method, *args, broadcast_timeout=1, quorum=None, **kwargs):
+        """Calls the remote procedure registered as ``method`` on every shard, and yields ``(shard ID, response)``
+        pairs in the order responses arrive.
+
+        Any other arguments are passed on to the procedure. Stops once every shard (or ``quorum`` shards) answered, or
+        after ``broadcast_timeout`` seconds. Failures are yielded as :class:`RemoteError` in place of the response,
+        like with :meth:`call`.
+        """
+        _id, data = self._request('all', type='call', method=method, args=args, kwargs=kwargs)
+        self.streams[_id] = queue = asyncio.Queue()
+        try:
+            await self._publish('all', data)
+            needed = self.liara.shard_count if quorum is None else quorum
+            deadline = self.liara.loop.time() + broadcast_timeout
+            seen = set()
+            while len(seen) < needed:
+                try:
+                    shard, response = await asyncio.wait_for(queue.get(), deadline - self.liara.loop.time())
+                except asyncio.TimeoutError:
+                    return
+                if shard in seen:
+                    continue
+                seen.add(shard)
+                yield shard, response
+        finally:
+            self.streams.pop(_id, None)
+
+    def _forget(self, _id, _):
+        self.futures.pop(_id, None)
+        self.broadcasts.pop(_id, None)
+
+    @staticmethod
+    def _published(future, publish):
+        if not publish.cancelled() and publish.exception() is not None and not future.done():
+            future.set_exception(publish.exception())
+
+    def _finish_broadcast(self, _id):
+        broadcast = self.broadcasts.pop(_id, None)
+        future = self.futures.pop(_id, None)
+        if broadcast is None or future is None or future.done():
+            return
+        future.set_result(broadcast[0])
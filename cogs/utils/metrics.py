@@ -0,0 +1,66 @@
+import math
+
+
+class Histogram:
+    """A histogram with logarithmic buckets, for latencies and sizes.
+
+    Memory use doesn't grow with the amount of values recorded, and percentiles are accurate to within a factor of
+    ``growth`` of the true value.
+    """
+    __slots__ = ('smallest', 'growth', 'count', 'total', 'min', 'max', '_buckets', '_log_growth')
+
+    def __init__(self, smallest=1e-6, growth=1.1):
+        self.smallest = smallest
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._buckets = {}  # bucket index -> count
+
+    def __repr__(self):
+        return '<Histogram count={} p50={} p99={}>'.format(self.count, self.percentile(50), self.percentile(99))
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= self.smallest:
+            index = 0
+        else:
+            index = int(math.log(value / self.smallest) / self._log_growth) + 1
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Gets an estimate of the value ``percent`` percent of recorded values are at or below."""
+        if not self.count:
+            return None
+        target = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= target:
+                upper = self.smallest * self.growth ** index
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {'count': self.count, 'mean': self.mean, 'p50': self.percentile(50), 'p95': self.percentile(95),
+                'p99': self.percentile(99), 'max': self.max}
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._buckets = {}
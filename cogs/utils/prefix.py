@@ -0,0 +1,38 @@
+class PrefixMatcher:
+    """Tells whether a message could be a command, without going through discord.py's prefix handling.
+
+    Prefixes are bucketed by their first character, so most messages are turned down with a single dict lookup.
+    Mentions of the bot (``<@id>`` and ``<@!id>``) are always accepted, and so is everything if the bot's prefix is a
+    callable, as there's no telling what it returns.
+    """
+    __slots__ = ('source', 'user_id', '_table', '_everything')
+
+    def __init__(self, prefixes, user_id=None):
+        self.source = prefixes  # the command_prefix this was compiled from
+        self.user_id = user_id
+        self._table = {}  # first character -> tuple of prefixes starting with it
+        self._everything = callable(prefixes)
+        if self._everything:
+            return
+        if isinstance(prefixes, str):
+            prefixes = (prefixes,)
+        prefixes = list(prefixes)
+        if user_id is not None:
+            prefixes += ['<@{}>'.format(user_id), '<@!{}>'.format(user_id)]
+        for prefix in prefixes:
+            if not prefix:
+                self._everything = True
+                return
+            self._table.setdefault(prefix[0], set()).add(prefix)
+        self._table = {k: tuple(v) for k, v in self._table.items()}
+
+    def __repr__(self):
+        return '<PrefixMatcher source={0.source!r} user_id={0.user_id!r}>'.format(self)
+
+    def __call__(self, content: str) -> bool:
+        if self._everything:
+            return True
+        if not content:
+            return False
+        candidates = self._table.get(content[0])
+        return candidates is not None and content.startswith(candidates)
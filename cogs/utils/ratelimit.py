@@ -0,0 +1,130 @@
+import time
+import typing
+
+import aredis
+
+# Takes a token from every bucket in KEYS, or from none of them if any is empty. ARGV is the current time followed by a
+# capacity and a refill rate (tokens per second) for each key. Returns how long to wait before retrying, as a string
+# since Lua numbers get truncated to integers on the way out, and "0" if the tokens were taken.
+_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local states = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local refill = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / refill)
+    end
+    states[i] = {tokens, capacity, refill}
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local tokens, capacity, refill = unpack(states[i])
+    redis.call('HMSET', key, 'tokens', tostring(tokens - 1), 'updated', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / refill * 1000) + 1000)
+end
+return "0"
+'''
+
+
+class Bucket(typing.NamedTuple):
+    """Allows ``rate`` commands every ``per`` seconds, in bursts of up to ``rate``."""
+    rate: int
+    per: float
+
+    @property
+    def refill(self) -> float:
+        return self.rate / self.per
+
+
+class RateLimiter:
+    """Token buckets for command invocations, shared by every shard through Redis.
+
+    Buckets are configured per scope: ``'user'``, ``'channel'`` and ``'guild'`` apply to every command, and
+    ``'command:<qualified name>'`` applies to that command, per user. An invocation has to get a token from each bucket
+    that applies to it, and all of them are checked and taken in a single atomic script run.
+
+    Callers who were turned down aren't checked against Redis again until they could have a token, so a spammer costs
+    no round trips. Backends without scripting (like :class:`~cogs.utils.backend.MemoryBackend`, which is never shared
+    between hosts anyway) get the same buckets kept in memory.
+    """
+    def __init__(self, redis: aredis.StrictRedis, buckets: typing.Dict[str, Bucket]=None, prefix='ratelimit'):
+        self.redis = redis
+        self.prefix = prefix
+        self.buckets = {}
+        self.configure(buckets or {})
+        self._blocked = {}  # bucket keys -> time.time() it gets a token again, the local fast path
+        self._local = {}  # bucket key -> (tokens, updated), for backends without scripting
+        self._script = redis.register_script(_SCRIPT) if hasattr(redis, 'register_script') else None
+
+    def configure(self, buckets: dict):
+        """Replaces the bucket configuration, from a mapping of scope to :class:`Bucket` or ``(rate, per)`` pair."""
+        self.buckets = {scope: Bucket(*bucket) for scope, bucket in buckets.items()}
+
+    def _keys(self, ctx) -> typing.List[typing.Tuple[str, Bucket]]:
+        ids = {'user': ctx.author.id, 'channel': ctx.channel.id, 'guild': ctx.guild and ctx.guild.id}
+        keys = []
+        for scope, _id in ids.items():
+            bucket = self.buckets.get(scope)
+            if bucket is not None and _id is not None:
+                keys.append(('{}:{}:{}'.format(self.prefix, scope, _id), bucket))
+        if ctx.command is not None:
+            scope = 'command:' + ctx.command.qualified_name
+            bucket = self.buckets.get(scope)
+            if bucket is not None:
+                keys.append(('{}:{}:{}'.format(self.prefix, scope, ctx.author.id), bucket))
+        return keys
+
+    async def hit(self, ctx) -> float:
+        """Takes a token for invoking ``ctx``'s command.
+
+        Returns 0 if the invocation may go ahead, and otherwise how many seconds to wait before trying again.
+        """
+        keys = self._keys(ctx)
+        if not keys:
+            return 0.0
+        now = time.time()
+        combination = tuple(key for key, _ in keys)  # one full bucket mustn't block the caller's other commands
+        wait = self._blocked.get(combination, 0) - now
+        if wait > 0:
+            return wait
+        if self._script is not None:
+            args = [now]
+            for _, bucket in keys:
+                args += [bucket.rate, bucket.refill]
+            wait = float(await self._script.execute(keys=combination, args=args))
+        else:
+            wait = self._hit_local(keys, now)
+        if wait > 0:
+            self._blocked[combination] = now + wait
+            if len(self._blocked) > 4096:
+                self._blocked = {k: v for k, v in self._blocked.items() if v > now}
+        return wait
+
+    def _hit_local(self, keys, now) -> float:
+        states = []
+        wait = 0.0
+        for key, bucket in keys:
+            tokens, updated = self._local.get(key, (bucket.rate, now))
+            tokens = min(bucket.rate, tokens + max(0.0, now - updated) * bucket.refill)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / bucket.refill)
+            states.append((key, tokens))
+        if wait > 0:
+            return wait
+        for key, tokens in states:
+            self._local[key] = (tokens - 1, now)
+        if len(self._local) > 65536:  # forget buckets that have had the time to fill up again
+            self._local = {k: v for k, v in self._local.items() if now - v[1] < self._bucket(k).per}
+        return 0.0
+
+    def _bucket(self, key) -> Bucket:
+        scope = key[len(self.prefix) + 1:].rpartition(':')[0]
+        return self.buckets.get(scope, Bucket(1, 0))
@@ -0,0 +1,90 @@
+import asyncio
+from collections import OrderedDict, deque
+
+
+class Overloaded(Exception):
+    """Raised when a command can't be queued because its queue is full."""
+    pass
+
+
+class CommandScheduler:
+    """Limits how many commands run at once, and shares the slots fairly between guilds.
+
+    Up to ``max_concurrent`` commands run at the same time, and no more than ``max_per_key`` of them for the same
+    guild (or channel, outside of guilds), so a single busy guild can't take every slot, not even with commands that
+    sit around waiting for input. Past that, commands wait in a queue per guild, and whenever a slot frees up the next
+    command is taken from the guild after the one that was served last, skipping guilds that are at their limit. A
+    guild can have up to ``max_queued`` commands waiting, anything past that is turned down with :class:`Overloaded`.
+    """
+    def __init__(self, max_concurrent=32, max_queued=5, max_per_key=8):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_per_key = max_per_key
+        self.running = 0
+        self._running = {}  # key -> commands it has running
+        self._queues = OrderedDict()  # key -> deque of futures waiting for a slot, in the order they're served
+
+    @property
+    def queued(self) -> int:
+        return sum(len(x) for x in self._queues.values())
+
+    async def run(self, key, func):
+        """Runs ``func``, a coroutine function taking no arguments, once there's a slot for it."""
+        # anything still queued while there are free slots is at its own limit, so this doesn't jump the line
+        if self.running < self.max_concurrent and self._running.get(key, 0) < self.max_per_key:
+            self._start(key)
+        else:
+            await self._wait(key)
+        try:
+            return await func()
+        finally:
+            self._release(key)
+
+    async def _wait(self, key):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        if len(queue) >= self.max_queued:
+            if not queue:
+                del self._queues[key]
+            raise Overloaded(key)
+        waiter = asyncio.get_event_loop().create_future()
+        queue.append(waiter)
+        try:
+            await waiter  # the slot is taken for us by _dispatch
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():  # got a slot just as we were cancelled, pass it on
+                self._release(key)
+            elif waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    self._queues.pop(key, None)
+            raise
+
+    def _start(self, key):
+        self.running += 1
+        self._running[key] = self._running.get(key, 0) + 1
+
+    def _release(self, key):
+        self.running -= 1
+        self._running[key] -= 1
+        if not self._running[key]:
+            del self._running[key]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hands out free slots to the queues in turn."""
+        while self.running < self.max_concurrent:
+            for key, queue in self._queues.items():
+                if self._running.get(key, 0) < self.max_per_key:
+                    break
+            else:
+                return  # nobody left who may run anything
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            if not waiter.done():
+                self._start(key)
+                waiter.set_result(None)
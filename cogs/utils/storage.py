@@ -1,49 +1,788 @@
+import asyncio
+import collections.abc
+import inspect
+import json
+import logging
+import struct
+import threading
+import time
 import typing
+import uuid
+import weakref
+from collections import OrderedDict
 
 import aredis
 import dill
 
+from cogs.utils.backend import MemoryBackend, database_id
+from cogs.utils.codec import Codec, decode, encode
+from cogs.utils.metrics import Histogram
+
+
+log = logging.getLogger('liara.storage')
+
+# identifies this process on the invalidation channel, so we don't drop our own write-through entries
+_origin = uuid.uuid4().hex
+_cached_collections = {}  # collection key -> weakref.WeakSet of cached collections using it
+_watchers = {}  # (collection key, field) -> callbacks to run when another process writes that field
+
 
 class _Nonexistant:
     pass
 
 
+# While true, keys are also looked up under the dill-pickled field names used before the compact encoding, and writes
+# clean those up. load_key_format turns this off once migrate_all_keys has been through the database.
+legacy_keys = True
+_MIGRATED_MARKER = '__keys_migrated__'
+
+_INT_KEY = b'\x01'  # followed by a signed 64-bit big-endian integer
+_OTHER_KEY = b'\x02'  # followed by a codec-encoded value
+_LEGACY_KEY = b'\x80'  # the pickle PROTO opcode dill output starts with, and never the first byte of valid UTF-8
+_int_key = struct.Struct('>q')
+
+
+def _encode_key(key) -> bytes:
+    """Encodes a key into a compact, canonical hash field name.
+
+    Strings are stored as plain UTF-8 and integers as 9 bytes. Anything else, or strings which would be mistaken for
+    one of those, is tagged and encoded like a value.
+    """
+    if isinstance(key, str) and not key.startswith(('\x01', '\x02')):
+        return key.encode()
+    if isinstance(key, int) and not isinstance(key, bool) and -2**63 <= key < 2**63:
+        return _INT_KEY + _int_key.pack(key)
+    return _OTHER_KEY + encode(key, record=False)
+
+
+def _decode_key(field: bytes) -> typing.Any:
+    tag = field[:1]
+    if tag == _INT_KEY:
+        return _int_key.unpack(field[1:])[0]
+    if tag == _OTHER_KEY:
+        return decode(field[1:])
+    if tag == _LEGACY_KEY:
+        return dill.loads(field)
+    return field.decode()
+
+
+def _legacy_key(key) -> bytes:
+    return dill.dumps(key)
+
+
+def _fields(key) -> list:
+    """Gets the fields a key may be stored under, most recent encoding first."""
+    return [_encode_key(key), _legacy_key(key)] if legacy_keys else [_encode_key(key)]
+
+
+def _legacy_fields(keys) -> list:
+    """Gets the legacy fields writes to ``keys`` have to clean up."""
+    return [_legacy_key(x) for x in keys] if legacy_keys else []
+
+
+class LocalCache:
+    """A bounded in-process LRU cache with per-entry expiry.
+
+    Entries are evicted least-recently-used first once ``max_size`` is exceeded, and expire ``ttl`` seconds after
+    being set unless a different ``ttl`` is passed to :meth:`set`. A ``ttl`` of ``None`` never expires.
+    """
+    __slots__ = ('max_size', 'ttl', 'version', '_entries')
+
+    def __init__(self, max_size=4096, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = 0  # bumped on every write and invalidation, lets readers detect that a fetch raced with one
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=_Nonexistant):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, expires = entry
+        if expires is not None and expires < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=_Nonexistant):
+        self.version += 1
+        self._store(key, value, ttl)
+
+    def fill(self, key, value, version, ttl=_Nonexistant):
+        """Caches a value read while the cache was at ``version``, unless something was written since.
+
+        Unlike :meth:`set`, this doesn't count as a write, so concurrent reads don't throw away each other's results.
+        """
+        if self.version == version:
+            self._store(key, value, ttl)
+
+    def _store(self, key, value, ttl):
+        if ttl is _Nonexistant:
+            ttl = self.ttl
+        self._entries[key] = (value, None if ttl is None else time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.version += 1
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self.version += 1
+        self._entries.clear()
+
+
+def invalidation_channel(redis: aredis.StrictRedis) -> str:
+    """Gets the pub/sub channel cached collections announce their writes on."""
+    return 'liara.{}.storage.invalidate'.format(database_id(redis))
+
+
+def _invalidation(origin, key, fields) -> bytes:
+    """Encodes an invalidation message. It's plain JSON, since every process decodes whatever is published."""
+    return json.dumps({'origin': origin, 'key': key, 'fields': [x.hex() for x in fields]}).encode()
+
+
+def _parse_invalidation(data) -> typing.Optional[typing.Tuple[typing.Optional[str], str, typing.List[bytes]]]:
+    """Decodes an invalidation message, or returns ``None`` if it isn't a valid one."""
+    try:
+        message = json.loads(data.decode())
+        origin, key, fields = message['origin'], message['key'], message['fields']
+        if not isinstance(origin, (str, type(None))) or not isinstance(key, str) or not isinstance(fields, list):
+            return None
+        return origin, key, [bytes.fromhex(x) for x in fields]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return None
+
+
+async def _write_fields(redis: aredis.StrictRedis, key, updates: dict, deletes: list, origin=_origin, announce=True):
+    """Sets and removes raw fields of a hash in a single round trip, announcing them on the invalidation channel.
+
+    Processes drop announcements with their own ``origin``, so ``None`` also reaches cached collections in this one.
+    """
+    async with await redis.pipeline(transaction=False) as pipe:
+        if len(updates) == 1:
+            await pipe.hset(key, *next(iter(updates.items())))
+        elif updates:
+            await pipe.hmset(key, updates)
+        if deletes:
+            await pipe.hdel(key, *deletes)
+        if announce:
+            await pipe.publish(invalidation_channel(redis), _invalidation(origin, key, list(updates) + list(deletes)))
+        await pipe.execute()
+
+
+def _invalidate_local(key, field, exclude=None):
+    for collection in list(_cached_collections.get(key, ())):
+        if collection is exclude:
+            continue
+        collection.cache.invalidate((key, field))
+
+
+def _clear_caches():
+    for cached in list(_cached_collections.values()):
+        for collection in list(cached):
+            collection.cache.clear()
+
+
+def _notify_watchers(key, fields):
+    callbacks = []
+    for field in fields:
+        callbacks.extend(_watchers.get((key, field), ()))
+    for callback in dict.fromkeys(callbacks):  # a key watched under its legacy field too only fires once
+        _run_watcher(callback)
+
+
+def _run_watcher(callback):
+    # noinspection PyBroadException
+    try:
+        out = callback()
+        if inspect.isawaitable(out):
+            asyncio.ensure_future(out).add_done_callback(_watcher_done)
+    except Exception:
+        log.exception('Storage watcher {!r} failed.'.format(callback))
+
+
+def _watcher_done(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.error('Storage watcher failed.', exc_info=future.exception())
+
+
+async def listen_for_invalidations(redis: aredis.StrictRedis):
+    """Drops locally cached fields whenever another process writes them, and runs watchers for those fields.
+
+    Run this as a task for as long as any cached :class:`RedisCollection` is in use.
+    """
+    missed = False
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(invalidation_channel(redis))
+            if missed:  # anything could have changed while we were gone
+                missed = False
+                for callback in dict.fromkeys(x for callbacks in list(_watchers.values()) for x in callbacks):
+                    _run_watcher(callback)
+            while True:
+                message = await pubsub.listen()
+                if message is None or message['type'] != 'message':
+                    continue
+                invalidation = _parse_invalidation(message['data'])
+                if invalidation is None:  # anyone can publish anything, and one bad message mustn't stop coherence
+                    log.debug('Dropped an invalid storage invalidation message.')
+                    continue
+                origin, key, fields = invalidation
+                if origin == _origin:
+                    continue
+                # noinspection PyBroadException
+                try:
+                    for field in fields:
+                        _invalidate_local(key, field)
+                    _notify_watchers(key, fields)
+                except Exception:
+                    log.exception('Failed to process a storage invalidation for {!r}.'.format(key))
+        except aredis.ConnectionError:
+            # we can't tell what we missed while disconnected, so start over
+            missed = True
+            _clear_caches()
+            log.warning('Lost the storage invalidation channel, retrying in a second.')
+            await asyncio.sleep(1)
+        finally:
+            pubsub.reset()
+
+
+class OperationStats:
+    """Counters for one kind of operation on one collection."""
+    __slots__ = ('calls', 'round_trips', 'cache_hits', 'bytes_read', 'bytes_written', 'latency', 'codec')
+
+    def __init__(self):
+        self.calls = 0
+        self.round_trips = 0
+        self.cache_hits = 0  # fields served from the local cache instead of Redis
+        self.bytes_read = 0  # field names and values received from Redis
+        self.bytes_written = 0  # and sent to it
+        self.latency = Histogram()  # seconds per call, start to finish
+        self.codec = Histogram()  # seconds per call spent encoding and decoding
+
+    def record(self, started, codec_time=0.0):
+        self.calls += 1
+        self.latency.record(time.perf_counter() - started)
+        self.codec.record(codec_time)
+
+    def to_dict(self) -> dict:
+        return {'calls': self.calls, 'round_trips': self.round_trips, 'cache_hits': self.cache_hits,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                'latency': self.latency.summary(), 'codec': self.codec.summary()}
+
+
+class StorageStats:
+    """Statistics for every :class:`RedisCollection` operation in this process, by collection and operation.
+
+    Collections whose keys only differ by an ID, like one per guild, are counted together.
+    """
+    def __init__(self):
+        self._operations = {}  # (collection, operation) -> OperationStats
+
+    def operation(self, collection: str, operation: str) -> OperationStats:
+        stats = self._operations.get((collection, operation))
+        if stats is None:
+            stats = self._operations[collection, operation] = OperationStats()
+        return stats
+
+    def snapshot(self) -> typing.Dict[typing.Tuple[str, str], dict]:
+        """Gets the current statistics, keyed by ``(collection, operation)``."""
+        return {k: v.to_dict() for k, v in self._operations.items()}
+
+    def reset(self):
+        self._operations.clear()
+
+
+stats = StorageStats()
+
+
+def _stats_key(key) -> str:
+    return ':'.join('*' if x.isdigit() else x for x in str(key).split(':'))
+
+
 class RedisCollection:
-    __slots__ = ('redis', 'key')
+    __slots__ = ('redis', 'key', 'cache', 'codec', '_stats_key', '__weakref__')
 
-    def __init__(self, redis: aredis.StrictRedis, key):
+    def __init__(self, redis: aredis.StrictRedis, key, cache: LocalCache=None, codec: Codec=None):
         self.redis = redis
         self.key = key
+        self.cache = cache
+        self.codec = codec  # values are written with this, but any registered codec can be read
+        self._stats_key = _stats_key(key)
+        if cache is not None:
+            _cached_collections.setdefault(key, weakref.WeakSet()).add(self)
 
-    async def __aiter__(self):
-        keys = await self.keys()
-        for key in keys:
-            yield key
+    def __aiter__(self):
+        return self.iter_keys()
+
+    def watch(self, key, callback):
+        """Calls ``callback`` whenever another process changes ``key``, or might have while we were disconnected.
+
+        ``callback`` takes no arguments and may be a coroutine function. Only writes made through cached collections
+        (and :class:`RedisDict`) are announced, and :func:`listen_for_invalidations` has to be running.
+        """
+        for field in _fields(key):
+            _watchers.setdefault((self.key, field), []).append(callback)
+
+    def unwatch(self, key, callback):
+        """Stops calling ``callback`` when ``key`` changes."""
+        for field in (_encode_key(key), _legacy_key(key)):  # legacy_keys may have been turned off since watch
+            callbacks = _watchers.get((self.key, field), [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                _watchers.pop((self.key, field), None)
+
+    async def _hmget(self, fields, op: OperationStats):
+        if not fields:
+            return []
+        if self.cache is None:
+            out = await self.redis.hmget(self.key, fields)
+            op.round_trips += 1
+            op.bytes_read += sum(len(x) for x in out if x is not None)
+            return out
+        out = [self.cache.get((self.key, x)) for x in fields]
+        missing = [x for x, data in zip(fields, out) if data is _Nonexistant]
+        op.cache_hits += len(fields) - len(missing)
+        if missing:
+            version = self.cache.version
+            fetched = dict(zip(missing, await self.redis.hmget(self.key, missing)))
+            op.round_trips += 1
+            op.bytes_read += sum(len(x) for x in fetched.values() if x is not None)
+            for field, data in fetched.items():  # unless a write landed while we were waiting
+                self.cache.fill((self.key, field), data, version)
+            out = [fetched[x] if data is _Nonexistant else data for x, data in zip(fields, out)]
+        return out
+
+    async def _write(self, updates: dict, deletes: list, op: OperationStats, announce=False):
+        """Sets and removes raw fields in a single round trip.
+
+        The changes are announced to other processes and collections if we're cached, or if ``announce`` is set.
+        """
+        announce = announce or self.cache is not None
+        await _write_fields(self.redis, self.key, updates, deletes, announce=announce)
+        op.round_trips += 1
+        op.bytes_written += sum(len(k) + len(v) for k, v in updates.items()) + sum(len(x) for x in deletes)
+        if announce:
+            changes = dict.fromkeys(deletes)
+            changes.update(updates)
+            for field, data in changes.items():
+                _invalidate_local(self.key, field, exclude=self)
+                if self.cache is not None:
+                    self.cache.set((self.key, field), data)
+
+    async def _read(self, keys: list, op: OperationStats) -> list:
+        fields = [_encode_key(x) for x in keys]
+        legacy = _legacy_fields(keys)
+        if not legacy:
+            return await self._hmget(fields, op)
+        out = await self._hmget(fields + legacy, op)
+        return [new if new is not None else old for new, old in zip(out[:len(fields)], out[len(fields):])]
+
+    async def _get(self, keys: list, default, operation):
+        op = stats.operation(self._stats_key, operation)
+        started = time.perf_counter()
+        out = await self._read(keys, op)
+        decoding = time.perf_counter()
+        out = [default if x is None else decode(x) for x in out]
+        op.record(started, time.perf_counter() - decoding)
+        return out
 
     async def get(self, key, default=None) -> typing.Any:
         """Gets a key from the collection."""
-        out = await self.redis.hget(self.key, dill.dumps(key))
-        if out is None:
-            return default
-        return dill.loads(out)
+        return (await self._get([key], default, 'get'))[0]
+
+    async def get_many(self, keys: typing.Iterable, default=None) -> typing.List[typing.Any]:
+        """Gets several keys from the collection in a single round trip.
+
+        Values are returned in the same order as the keys, with ``default`` in place of missing ones.
+        """
+        return await self._get(list(keys), default, 'get_many')
+
+    async def _set(self, mapping: dict, operation):
+        op = stats.operation(self._stats_key, operation)
+        started = time.perf_counter()
+        updates = {_encode_key(k): encode(v, self.codec) for k, v in mapping.items()}
+        deletes = _legacy_fields(mapping)
+        encoded = time.perf_counter()
+        await self._write(updates, deletes, op)
+        op.record(started, encoded - started)
 
     async def set(self, key, value):
         """Sets a key in the collection."""
-        await self.redis.hset(self.key, dill.dumps(key), dill.dumps(value))
+        await self._set({key: value}, 'set')
+
+    async def set_many(self, mapping: dict):
+        """Sets several keys in the collection in a single round trip."""
+        mapping = dict(mapping)
+        if not mapping:
+            return
+        await self._set(mapping, 'set_many')
+
+    async def _delete(self, keys: list, operation):
+        op = stats.operation(self._stats_key, operation)
+        started = time.perf_counter()
+        fields = [_encode_key(x) for x in keys] + _legacy_fields(keys)
+        encoded = time.perf_counter()
+        await self._write({}, fields, op)
+        op.record(started, encoded - started)
 
     async def delete(self, key):
         """Removes a key. Does nothing if the key doesn't exist."""
-        await self.redis.hdel(self.key, dill.dumps(key))
+        await self._delete([key], 'delete')
+
+    async def delete_many(self, keys: typing.Iterable):
+        """Removes several keys in a single round trip. Keys that don't exist are skipped."""
+        keys = list(keys)
+        if not keys:
+            return
+        await self._delete(keys, 'delete_many')
 
     async def keys(self) -> typing.List[typing.Any]:
         """Lists all keys."""
+        op = stats.operation(self._stats_key, 'keys')
+        started = time.perf_counter()
         _keys = await self.redis.hkeys(self.key)
-        return [dill.loads(x) for x in _keys]
+        op.round_trips += 1
+        op.bytes_read += sum(len(x) for x in _keys)
+        decoding = time.perf_counter()
+        out = list(dict.fromkeys(_decode_key(x) for x in _keys))
+        op.record(started, time.perf_counter() - decoding)
+        return out
 
     async def to_dict(self) -> dict:
         """Returns the collection as a Python dictionary."""
+        op = stats.operation(self._stats_key, 'to_dict')
+        started = time.perf_counter()
         res = await self.redis.hgetall(self.key)
+        op.round_trips += 1
+        op.bytes_read += sum(len(k) + len(v) for k, v in dict(res).items())
+        decoding = time.perf_counter()
         out = {}
-        for key, value in dict(res).items():
-            out[dill.loads(key)] = dill.loads(value)
+        # legacy fields first, so the current ones win if a key has both
+        for key, value in sorted(dict(res).items(), key=lambda x: not x[0].startswith(_LEGACY_KEY)):
+            out[_decode_key(key)] = decode(value)
+        op.record(started, time.perf_counter() - decoding)
         return out
+
+    async def migrate_keys(self, batch_size=100) -> int:
+        """Rewrites fields stored under legacy dill-pickled names to the compact key encoding.
+
+        Returns the amount of fields rewritten.
+        """
+        migrated = 0
+        legacy = {}
+        async for field, data in self._scan(batch_size):
+            if field.startswith(_LEGACY_KEY):
+                legacy[field] = data
+            if len(legacy) >= batch_size:
+                migrated += await self._migrate_fields(legacy)
+                legacy = {}
+        if legacy:
+            migrated += await self._migrate_fields(legacy)
+        return migrated
+
+    async def _migrate_fields(self, legacy: dict) -> int:
+        op = stats.operation(self._stats_key, 'migrate')
+        started = time.perf_counter()
+        fields = {}
+        for field in legacy:
+            # noinspection PyBroadException
+            try:
+                fields[field] = _encode_key(dill.loads(field))
+            except Exception:  # leave it be, it's no worse off than before
+                log.warning('Skipped undecodable field {!r} in {}.'.format(field, self.key))
+        if not fields:
+            return 0
+        current = await self.redis.hmget(self.key, list(fields.values()))
+        op.round_trips += 1
+        # if a key has been written since, the current field is newer than the legacy one
+        updates = {new: legacy[old] for (old, new), data in zip(fields.items(), current) if data is None}
+        # cached collections everywhere may hold the new fields as missing, and have to read them again
+        await self._write(updates, list(fields), op, announce=True)
+        op.record(started)
+        return len(fields)
+
+    async def _scan(self, batch_size):
+        """Walks the hash with HSCAN. Each batch is counted as one call of the ``scan`` operation."""
+        op = stats.operation(self._stats_key, 'scan')
+        cursor = 0
+        while True:
+            started = time.perf_counter()
+            cursor, batch = await self.redis.hscan(self.key, cursor, count=batch_size)
+            op.round_trips += 1
+            op.bytes_read += sum(len(k) + len(v) for k, v in batch.items())
+            op.record(started)
+            for item in batch.items():
+                yield item
+            if not cursor:
+                return
+
+    async def iter_keys(self, batch_size=100) -> typing.AsyncIterator[typing.Any]:
+        """Iterates over all keys, fetching roughly ``batch_size`` at a time.
+
+        Like HSCAN, this may yield a key more than once if the collection is modified while iterating.
+        """
+        seen = set() if legacy_keys else None  # keys stored under both field names
+        async for field, _ in self._scan(batch_size):
+            key = _decode_key(field)
+            if seen is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield key
+
+    async def iter_values(self, batch_size=100) -> typing.AsyncIterator[typing.Any]:
+        """Iterates over all values, fetching roughly ``batch_size`` at a time."""
+        async for _, data in self._scan(batch_size):
+            yield decode(data)
+
+    async def iter_items(self, batch_size=100) -> typing.AsyncIterator[typing.Tuple[typing.Any, typing.Any]]:
+        """Iterates over all ``(key, value)`` pairs, fetching roughly ``batch_size`` at a time."""
+        async for field, data in self._scan(batch_size):
+            yield _decode_key(field), decode(data)
+
+
+async def migrate_all_keys(redis: aredis.StrictRedis) -> typing.Dict[str, int]:
+    """Rewrites legacy field names to the compact key encoding in every hash in the database.
+
+    Once done, the database is marked as migrated, so :func:`load_key_format` stops looking up legacy field names.
+    Returns the amount of fields rewritten per hash, leaving out hashes that were already up to date.
+    """
+    global legacy_keys
+    out = {}
+    cursor = 0
+    while True:
+        cursor, names = await redis.scan(cursor, count=100)
+        for name in names:
+            if await redis.type(name) not in (b'hash', 'hash'):
+                continue
+            name = name.decode() if isinstance(name, bytes) else name
+            migrated = await RedisCollection(redis, name).migrate_keys()
+            if migrated:
+                out[name] = migrated
+        if not cursor:
+            break
+    await redis.set(_MIGRATED_MARKER, '1')
+    # anything cached under the old lookup rules might only have been found under a legacy field
+    _clear_caches()
+    legacy_keys = False
+    return out
+
+
+async def load_key_format(redis: aredis.StrictRedis) -> bool:
+    """Turns off legacy field name lookups if :func:`migrate_all_keys` has been through the database.
+
+    Call this before anything reads from storage. Returns whether legacy field names are still looked up.
+    """
+    global legacy_keys
+    legacy_keys = not await redis.exists(_MIGRATED_MARKER)
+    return legacy_keys
+
+
+class GuildSettings:
+    """Per-guild settings, kept in one hash per guild with one field per attribute.
+
+    Attributes can be read and written individually, so changing one doesn't reserialize (or race with changes to)
+    the rest of the guild's settings.
+    """
+    __slots__ = ('redis', 'key', 'cache', '_collections')
+
+    def __init__(self, redis: aredis.StrictRedis, key='settings', cache: LocalCache=None):
+        self.redis = redis
+        self.key = key
+        self.cache = cache  # shared by every guild's collection
+        self._collections = {}
+
+    def collection(self, guild_id) -> RedisCollection:
+        """Gets the collection holding a guild's settings."""
+        collection = self._collections.get(guild_id)
+        if collection is None:
+            collection = RedisCollection(self.redis, '{}:guilds:{}'.format(self.key, guild_id), cache=self.cache)
+            self._collections[guild_id] = collection
+        return collection
+
+    async def get(self, guild_id, attribute, default=None) -> typing.Any:
+        """Gets a guild's setting."""
+        return await self.collection(guild_id).get(attribute, default)
+
+    async def set(self, guild_id, attribute, value):
+        """Sets a guild's setting."""
+        await self.collection(guild_id).set(attribute, value)
+
+    async def set_many(self, guild_id, mapping: dict):
+        """Sets several of a guild's settings in a single round trip."""
+        await self.collection(guild_id).set_many(mapping)
+
+    async def delete(self, guild_id, attribute):
+        """Removes a guild's setting, reverting it to its default."""
+        await self.collection(guild_id).delete(attribute)
+
+    async def to_dict(self, guild_id) -> dict:
+        """Returns all of a guild's settings as a Python dictionary."""
+        return await self.collection(guild_id).to_dict()
+
+    async def migrate(self, settings: RedisCollection) -> int:
+        """Moves guilds out of the old layout, where each guild's settings were one dict stored in ``settings`` as
+        ``guilds:<id>``.
+
+        Returns the amount of guilds migrated.
+        """
+        keys = [x async for x in settings.iter_keys() if isinstance(x, str) and x.startswith('guilds:')]
+        if not keys:
+            return 0
+        for key, guild in zip(keys, await settings.get_many(keys, {})):
+            await self.set_many(int(key.split(':', 1)[1]), guild)
+        await settings.delete_many(keys)
+        return len(keys)
+
+
+class _BlockingRunner:
+    """Runs storage coroutines to completion from synchronous code.
+
+    aredis only speaks asyncio, and synchronous callers are usually running on the bot's own event loop, which can't
+    be blocked on itself. Instead, coroutines run on a private loop in a worker thread, with their own connections
+    to the same server.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self, redis):
+        if isinstance(redis, MemoryBackend):  # already thread-safe, and has no connections to bind
+            return redis
+        client = self._clients.get(redis)
+        if client is None:
+            pool = redis.connection_pool
+            kwargs = dict(pool.connection_kwargs, loop=None)  # bind to the runner's loop, not the bot's
+            client = aredis.StrictRedis(connection_pool=type(pool)(connection_class=pool.connection_class, **kwargs))
+            self._clients[redis] = client
+        return client
+
+    def run(self, redis: aredis.StrictRedis, func):
+        """Calls ``func`` with a client for ``redis`` and blocks until the coroutine it returns is done."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(name='storage runner', target=self._loop.run_forever, daemon=True).start()
+
+        async def call():
+            return await func(self._client(redis))
+        return asyncio.run_coroutine_threadsafe(call(), self._loop).result()
+
+
+_runner = _BlockingRunner()
+
+
+class RedisDict(collections.abc.MutableMapping):
+    """A synchronous dict-like view over a Redis hash, for code that can't await, like Red's dataIO.
+
+    Fields are loaded the first time they're accessed. Changes stay local until :meth:`commit`, which writes only the
+    fields that changed (including values mutated in place) in a single pipeline.
+    """
+    def __init__(self, key, redis: aredis.StrictRedis, codec: Codec=None):
+        self.key = key
+        self.redis = redis
+        self.codec = codec
+        self._data = {}  # fields we've loaded or set locally
+        self._stored = {}  # field -> raw value as last seen in Redis, None if it didn't exist
+        self._dirty = set()  # fields set or deleted since the last commit
+        self._keys = None  # every key, once something has needed the full list
+
+    def __repr__(self):
+        return '<RedisDict key={!r} loaded={} dirty={}>'.format(self.key, len(self._data), len(self._dirty))
+
+    def _load(self, key):
+        if key in self._stored or key in self._dirty:
+            return
+        if self._keys is not None and key not in self._keys:
+            self._stored[key] = None
+            return
+        fields = _fields(key)
+        data = next((x for x in _runner.run(self.redis, lambda client: client.hmget(self.key, fields))
+                     if x is not None), None)
+        self._stored[key] = data
+        if data is not None:
+            self._data[key] = decode(data)
+
+    def _load_keys(self):
+        if self._keys is None:
+            fields = _runner.run(self.redis, lambda client: client.hkeys(self.key))
+            self._keys = {_decode_key(x) for x in fields}
+            self._keys.update(self._data)
+            self._keys.difference_update(x for x in self._dirty if x not in self._data)
+        return self._keys
+
+    def __getitem__(self, key):
+        self._load(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._dirty.add(key)
+        if self._keys is not None:
+            self._keys.add(key)
+
+    def __delitem__(self, key):
+        self._load(key)
+        del self._data[key]
+        self._dirty.add(key)
+        if self._keys is not None:
+            self._keys.discard(key)
+
+    def __contains__(self, key):
+        self._load(key)
+        return key in self._data
+
+    def __iter__(self):
+        return iter(list(self._load_keys()))
+
+    def __len__(self):
+        return len(self._load_keys())
+
+    def changed(self) -> typing.Set[typing.Any]:
+        """Gets the keys that differ from what's stored, including loaded values that were mutated in place."""
+        changed = set(self._dirty)
+        for key, value in self._data.items():
+            if key not in changed and encode(value, self.codec, record=False) != self._stored.get(key):
+                changed.add(key)
+        return changed
+
+    def commit(self, *keys):
+        """Writes changes back to Redis in a single round trip.
+
+        If keys are given, only those are written, otherwise every changed key is.
+        """
+        keys = set(keys) if keys else self.changed()
+        changes = {}
+        for key in keys:
+            if key in self._data:
+                changes[key] = encode(self._data[key], self.codec)
+            elif key in self._dirty:
+                changes[key] = None
+        if not changes:
+            return
+
+        updated = {_encode_key(k): v for k, v in changes.items() if v is not None}
+        deleted = [_encode_key(k) for k, v in changes.items() if v is None] + _legacy_fields(changes)
+        # no origin, so cached collections in this process drop their copies too
+        _runner.run(self.redis, lambda client: _write_fields(client, self.key, updated, deleted, origin=None))
+
+        for key, data in changes.items():
+            self._stored[key] = data
+            self._dirty.discard(key)
+
+    def refresh(self):
+        """Forgets everything loaded so far, so the next access reads from Redis again. Uncommitted changes are lost."""
+        self._data.clear()
+        self._stored.clear()
+        self._dirty.clear()
+        self._keys = None
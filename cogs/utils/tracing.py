@@ -0,0 +1,102 @@
+import collections
+import logging
+import time
+import typing
+
+from discord.ext import commands
+
+from cogs.utils.metrics import Histogram
+
+
+log = logging.getLogger('liara.tracing')
+
+# the stages a command goes through, in order
+STAGES = ('mode', 'overrides', 'preconditions', 'resolve', 'ratelimit', 'queue', 'checks', 'command', 'send')
+
+
+class Trace:
+    """Timings for a single message, from the moment :meth:`Core.on_message` sees it."""
+    __slots__ = ('started', 'stages', '_last')
+
+    def __init__(self):
+        self.started = self._last = time.perf_counter()
+        self.stages = {}  # stage -> seconds
+
+    def mark(self, stage):
+        """Ends ``stage``, which started when the previous stage ended."""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def add(self, stage, duration):
+        """Adds time spent in ``stage`` while another stage was running, like sending messages from a command."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+    @property
+    def elapsed(self) -> float:
+        return self._last - self.started
+
+
+class TracedContext(commands.Context):
+    """A context which adds the time its messages take to send to the invocation's trace."""
+    trace: Trace = None
+
+    async def send(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().send(*args, **kwargs)
+        finally:
+            if self.trace is not None:
+                self.trace.add('send', time.perf_counter() - started)
+
+
+class CommandTracer:
+    """Latency histograms for every stage of command processing, and for each command as a whole.
+
+    Invocations slower than ``slow_threshold`` seconds are logged with their arguments, and the last
+    ``slow_log_size`` of them are kept around.
+    """
+    def __init__(self, slow_threshold=2.0, slow_log_size=50):
+        self.slow_threshold = slow_threshold
+        self.stages = {x: Histogram() for x in STAGES}
+        self.commands = {}  # qualified name -> Histogram
+        self.slow = collections.deque(maxlen=slow_log_size)  # dicts, newest last
+
+    def record(self, ctx: TracedContext):
+        trace = ctx.trace
+        for stage, duration in trace.stages.items():
+            self.stages[stage].record(duration)
+        name = ctx.command.qualified_name
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = Histogram()
+        histogram.record(trace.elapsed)
+        if self.slow_threshold is not None and trace.elapsed > self.slow_threshold:
+            entry = {
+                'command': name,
+                'elapsed': trace.elapsed,
+                'stages': dict(trace.stages),
+                'args': [repr(x) for x in ctx.args if x is not ctx and x is not ctx.cog],
+                'kwargs': {k: repr(v) for k, v in ctx.kwargs.items()},
+                'guild_id': ctx.guild and ctx.guild.id,
+                'user_id': ctx.author.id,
+                'time': time.time()
+            }
+            self.slow.append(entry)
+            log.warning('Slow command {} took {:.2f}s with args {} {}, stages: {}'.format(
+                name, trace.elapsed, entry['args'], entry['kwargs'],
+                ', '.join('{} {:.3f}s'.format(k, v) for k, v in entry['stages'].items())))
+
+    def snapshot(self) -> typing.Dict[str, typing.Dict[str, dict]]:
+        """Gets summaries of the stage and per-command histograms."""
+        return {'stages': {k: v.summary() for k, v in self.stages.items() if v.count},
+                'commands': {k: v.summary() for k, v in self.commands.items()}}
+
+    def reset(self):
+        for histogram in self.stages.values():
+            histogram.reset()
+        self.commands.clear()
+        self.slow.clear()
+
+
+tracer = CommandTracer()
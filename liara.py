@@ -8,30 +8,18 @@ import logging
 import os
 import platform
 import sys
-import threading
 import time
-import uuid
 import discord
-from concurrent.futures import TimeoutError, ThreadPoolExecutor
 from hashlib import sha256
 
-import dill
 import aredis
 from discord import utils as dutils
 from discord.ext import commands
 
-from cogs.utils.storage import RedisCollection
-
-
-class NoResponse:
-    def __repr__(self):
-        return '<NoResponse>'
-
-    def __eq__(self, other):
-        if isinstance(other, NoResponse):
-            return True
-        else:
-            return False
+from cogs.utils.backend import MemoryBackend, database_id
+from cogs.utils.ipc import IPC
+from cogs.utils.runtime import CoreMode
+from cogs.utils.storage import GuildSettings, LocalCache, RedisCollection, listen_for_invalidations, load_key_format
 
 
 def create_bot(auto_shard: bool):
@@ -51,18 +39,17 @@ def create_bot(auto_shard: bool):
                                                            self.args.shard_count).encode()).hexdigest()
             self.logger = logging.getLogger('liara')
             self.logger.info('Liara is booting, please wait...')
-            self.settings = RedisCollection(self.redis, 'settings')
+            self.settings = RedisCollection(self.redis, 'settings', cache=LocalCache())
+            self.guild_settings = GuildSettings(self.redis, cache=LocalCache())
+            self.mode = CoreMode.boot  # the core cog keeps this in sync with the instance's stored mode
             self.owner = None  # this gets updated in on_ready
             self.invite_url = None  # this too
             self.send_cmd_help = send_cmd_help
             self.send_command_help = send_cmd_help  # seems more like a method name discord.py would choose
             self.self_bot = kwargs.get('self_bot', False)
-            db = str(self.redis.connection_pool.connection_kwargs['db'])
+            db = str(database_id(self.redis))
             self.pubsub_id = 'liara.{}.pubsub.code'.format(db)
-            self._pubsub_futures = {}  # futures temporarily stored here
-            self._pubsub_broadcast_cache = {}
-            self._pubsub_pool = ThreadPoolExecutor(max_workers=1)
-            self.t1 = threading.Thread(name='pubsub cache', target=self._pubsub_cache_loop, daemon=True)
+            self.ipc = IPC(self, self.pubsub_id, allow_code=getattr(self.args, 'ipc_code', False))
             super().__init__(*args, **kwargs)
 
             self.ready = False  # we expect the loader to set this once ready
@@ -70,8 +57,11 @@ def create_bot(auto_shard: bool):
         async def init(self):
             """Initializes the bot."""
             # pubsub
-            self.t1.start()
-            # self.loop.create_task(self._pubsub_loop())
+            self._ipc_task = self.loop.create_task(self.ipc.listen())
+            # keeps cached settings coherent across shards
+            self._invalidation_task = self.loop.create_task(listen_for_invalidations(self.redis))
+            if await load_key_format(self.redis):
+                self.logger.info('Looking up settings under legacy key names too, run migrate_keys to stop this.')
 
             # load the core cog
             default = 'cogs.core'
@@ -80,101 +70,26 @@ def create_bot(auto_shard: bool):
             if loader != default:
                 self.logger.warning('Using third-party loader and core cog, {0}.'.format(loader))
 
-        def _process_pubsub_event(self, event):
-            _id = self.pubsub_id
-            if event['type'] != 'message':
-                return
-            try:
-                _data = dill.loads(event['data'])
-                target = _data.get('target')
-                broadcast = target == 'all'
-                if not isinstance(_data, dict):
-                    return
-                # get type, if this is a broken dict just ignore it
-                if _data.get('type') is None:
-                    return
-                # ping response
-                if target == self.shard_id or broadcast:
-                    if _data['type'] == 'ping':
-                        self.redis.publish(_id, dill.dumps({'type': 'response', 'id': _data.get('id'),
-                                                            'response': 'Pong.'}))
-                    if _data['type'] == 'coderequest':
-                        func = _data.get('function')  # get the function, discard if None
-                        if func is None:
-                            return
-                        resp = {'type': 'response', 'id': _data.get('id'), 'response': None}
-                        if broadcast:
-                            resp['from'] = self.shard_id
-                        args = _data.get('args', ())
-                        kwargs = _data.get('kwargs', {})
-                        try:
-                            # noinspection PyCallingNonCallable
-                            resp['response'] = func(self, *args, **kwargs)  # this gets run in a thread so whatever
-                        except Exception as e:
-                            resp['response'] = e
-                        try:
-                            self.redis.publish(_id, dill.dumps(resp))
-                        except dill.PicklingError:  # if the response fails to dill, return None instead
-                            resp = {'type': 'response', 'id': _data.get('id')}
-                            if broadcast:
-                                resp['from'] = self.shard_id
-                            self.redis.publish(_id, dill.dumps(resp))
-                if _data['type'] == 'response':
-                    __id = _data.get('id')
-                    _from = _data.get('from')
-                    if __id is None:
-                        return
-                    if __id not in self._pubsub_futures:
-                        return
-                    if __id not in self._pubsub_broadcast_cache and _from is not None:
-                        return
-                    if _from is None:
-                        self._pubsub_futures[__id].set_result(_data.get('response'))
-                        del self._pubsub_futures[__id]
-                    else:
-                        self._pubsub_broadcast_cache[__id][_from] = _data.get('response')
-
-            except dill.UnpicklingError:
-                return
-
-        async def _pubsub_loop(self):
-            pubsub = self.redis.pubsub()
-            _id = self.pubsub_id
-            pubsub.subscribe(_id)
-            async for event in pubsub.listen():
-                self._pubsub_pool.submit(self._process_pubsub_event, event)
-
-        def _pubsub_cache_loop(self):
-            while True:
-                for k, v in dict(self._pubsub_broadcast_cache).items():
-                    contents = [v[x] for x in v if x != 'expires']
-                    if v['expires'] < time.monotonic() or NoResponse() not in contents:
-                        del v['expires']
-                        self._pubsub_futures[k].set_result(v)
-                        del self._pubsub_futures[k]
-                        del self._pubsub_broadcast_cache[k]
-                time.sleep(0.01)  # be nice to the host
-
         def request(self, target, broadcast_timeout=1, **kwargs):
-            _id = str(uuid.uuid4())
-            self._pubsub_futures[_id] = fut = asyncio.Future()
-            request = {'id': _id, 'target': target}
-            request.update(kwargs)
-            if target == 'all':
-                cache = {k: NoResponse() for k in range(0, self.shard_count)}  # prepare the cache
-                cache['expires'] = time.monotonic() + broadcast_timeout
-                self._pubsub_broadcast_cache[_id] = cache
-            self.redis.publish(self.pubsub_id, dill.dumps(request))
-            return fut
+            return self.ipc.request(target, broadcast_timeout, **kwargs)
+
+        async def call_shard(self, shard, method, *args, **kwargs):
+            """Calls a remote procedure other shards registered with ``liara.ipc.register``."""
+            return await self.ipc.call(shard, method, *args, **kwargs)
+
+        def stream_shards(self, method, *args, **kwargs):
+            """Calls a remote procedure on every shard, yielding ``(shard ID, response)`` as responses arrive."""
+            return self.ipc.stream(method, *args, **kwargs)
 
         async def run_on_shard(self, shard, func, *args, **kwargs):
-            return await self.request(shard, type='coderequest', function=func, args=args, kwargs=kwargs)
+            """Runs any function on another shard, if every shard involved was started with ``--ipc_code``."""
+            return await self.request(shard, type='code', function=func, args=args, kwargs=kwargs)
 
         async def ping_shard(self, shard, timeout=1):
             try:
                 await asyncio.wait_for(self.request(shard, type='ping'), timeout=timeout)
                 return True
-            except TimeoutError:
+            except asyncio.TimeoutError:
                 return False
 
         async def on_ready(self):
@@ -232,6 +147,7 @@ if __name__ == '__main__':
     token = os.environ.get('LIARA_TOKEN', None)
     redis_host = os.environ.get('LIARA_REDIS_HOST', 'localhost')
     redis_pass = os.environ.get('LIARA_REDIS_PASSWORD', None)
+    storage_path = os.environ.get('LIARA_STORAGE', None)
     try:
         redis_port = int(os.environ.get('LIARA_REDIS_PORT', 6379))
         redis_db = int(os.environ.get('LIARA_REDIS_DB', 0))
@@ -252,6 +168,29 @@ if __name__ == '__main__':
               'Please check that these can be converted to integers')
         exit(4)
 
+    lazy_cogs = os.environ.get('LIARA_LAZY_COGS', '').lower() in ('1', 'true', 'yes')
+    ipc_code = os.environ.get('LIARA_IPC_CODE', '').lower() in ('1', 'true', 'yes')
+
+    sync_interval = os.environ.get('LIARA_SYNC_INTERVAL', 300)
+    try:
+        sync_interval = float(sync_interval)
+    except ValueError:
+        print('Error parsing environment variable LIARA_SYNC_INTERVAL\n'
+              'Please check that this can be converted to a number')
+        exit(4)
+
+    max_concurrent = os.environ.get('LIARA_MAX_CONCURRENT', 32)
+    max_per_guild = os.environ.get('LIARA_MAX_PER_GUILD', 8)
+    max_queued = os.environ.get('LIARA_MAX_QUEUED', 5)
+    try:
+        max_concurrent = int(max_concurrent)
+        max_per_guild = int(max_per_guild)
+        max_queued = int(max_queued)
+    except ValueError:
+        print('Error parsing environment variables LIARA_MAX_CONCURRENT, LIARA_MAX_PER_GUILD or LIARA_MAX_QUEUED\n'
+              'Please check that these can be converted to integers')
+        exit(4)
+
     message_cache = os.environ.get('LIARA_MESSAGE_CACHE_COUNT', 5000)
     try:
         if message_cache is not None:
@@ -273,7 +212,18 @@ if __name__ == '__main__':
     parser.add_argument('--message_cache_count', help='sets the maximum amount of messages to cache in liara.messages',
                         default=message_cache, type=int)
     parser.add_argument('--uvloop', help='enables uvloop mode', action='store_true')
+    parser.add_argument('--ipc_code', help='lets shards run arbitrary code sent by other shards, only enable this if '
+                                           'nobody else can publish to your Redis',
+                        action='store_true', default=ipc_code)
+    parser.add_argument('--lazy_cogs', help='only load cogs that allow it once one of their commands is used',
+                        action='store_true', default=lazy_cogs)
     parser.add_argument('--stateless', help='disables file storage', action='store_true')
+    parser.add_argument('--max_concurrent', type=int, help='the maximum amount of commands running at once',
+                        default=max_concurrent)
+    parser.add_argument('--max_per_guild', type=int, help='the maximum amount of commands running at once in a guild',
+                        default=max_per_guild)
+    parser.add_argument('--max_queued', type=int, help='the maximum amount of commands a guild can have waiting to '
+                                                       'run, any more are turned down', default=max_queued)
     parser.add_argument('token', type=str, help='sets the token', default=token, nargs='?')
     shard_grp = parser.add_argument_group('sharding')
     # noinspection PyUnboundLocalVariable
@@ -288,6 +238,11 @@ if __name__ == '__main__':
     # noinspection PyUnboundLocalVariable
     redis_grp.add_argument('--db', type=int, help='the Redis database', default=redis_db)
     redis_grp.add_argument('--password', type=str, help='the Redis password', default=redis_pass)
+    redis_grp.add_argument('--storage', type=str, help='use an embedded store persisted to this file instead of Redis '
+                                                       '(single-host deployments only)', default=storage_path)
+    redis_grp.add_argument('--sync_interval', type=float, help='seconds between full reloads of the global settings, '
+                                                               'which are otherwise applied as they change',
+                           default=sync_interval)
     cargs = parser.parse_args()
 
     if cargs.token is None:
@@ -376,7 +331,18 @@ if __name__ == '__main__':
         cargs.shard_id -= 1
 
     # Redis connection attempt
-    redis_conn = aredis.StrictRedis(host=cargs.host, port=cargs.port, db=cargs.db, password=cargs.password)
+    if cargs.storage is not None:
+        if cargs.shard_id is not None or cargs.shard_count is not None:
+            print('Embedded storage can\'t be shared between shards, please use Redis for sharded deployments')
+            exit(4)
+        try:
+            redis_conn = MemoryBackend(cargs.storage, db=cargs.db)
+        except RuntimeError as e:
+            print('Unable to open embedded storage: {}'.format(e))
+            exit(4)
+        logger.info('Using embedded storage at {}, shards on other hosts won\'t see this data.'.format(cargs.storage))
+    else:
+        redis_conn = aredis.StrictRedis(host=cargs.host, port=cargs.port, db=cargs.db, password=cargs.password)
 
     # sharding logic
     unsharded = True